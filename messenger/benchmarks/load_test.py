@@ -0,0 +1,364 @@
+"""
+Нагрузочный тест сервера мессенджера.
+
+Запускает server/main.py (uvicorn) на localhost во временном каталоге с чистой
+базой, регистрирует N пользователей, открывает по WebSocket на каждого и
+гоняет смесь запросов: отправка сообщений, чтение истории, список
+пользователей, удаление. Отчёт: пропускная способность, p50/p95/p99 по
+каждому типу запроса и задержка доставки сообщения получателю по WebSocket
+(от начала POST /messages до прихода события new_message).
+
+Зависимости - зафиксированные версии сервера и клиентов нагрузки:
+    pip install -r benchmarks/requirements.txt
+
+Запуск из каталога messenger:
+    python benchmarks/load_test.py --users 20 --duration 30
+    python benchmarks/load_test.py --mix send=50,history=30,users=15,delete=5 --output results.json
+    python benchmarks/load_test.py --url http://127.0.0.1:8000   # уже запущенный сервер
+
+Результаты сравнимы только при одинаковых параметрах и на одной машине;
+--output сохраняет их вместе с параметрами запуска и окружением.
+Базовый замер: benchmarks/results/load_test_baseline.json (параметры по умолчанию, --seed 1;
+генератор нагрузки и сервер работали на одной машине, пакеты - из benchmarks/requirements.txt).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from importlib import metadata
+from pathlib import Path
+
+import httpx
+import websockets
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+DEFAULT_MIX = "send=60,history=20,users=15,delete=5"
+PASSWORD = "load-test-password"
+SUBPROTOCOL = "messenger.v1.json"
+AUTH_PROTOCOL_PREFIX = "messenger.auth."
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("send", "history", "users", "delete"):
+            raise argparse.ArgumentTypeError(f"unknown operation: {name}")
+        mix[name] = float(weight)
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("mix must contain at least one positive weight")
+    return mix
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """server/main.py в отдельном процессе; база и вложения - во временном каталоге"""
+
+    def __init__(self, port: int, workers: int, rate_limits: str):
+        self.port = port
+        self.workers = workers
+        self.rate_limits = rate_limits
+        self.workdir = tempfile.TemporaryDirectory(prefix="messenger-load-")
+        self.process = None
+
+    def start(self):
+        env = dict(os.environ)
+        env.update({
+            "MESSENGER_HOST": "127.0.0.1",
+            "MESSENGER_PORT": str(self.port),
+            "MESSENGER_WORKERS": str(self.workers),
+            "MESSENGER_RATE_LIMITS": self.rate_limits,
+        })
+        if self.workers > 1:
+            env["MESSENGER_FANOUT"] = "hub"
+            env["MESSENGER_HUB_SOCKET"] = str(Path(self.workdir.name) / "fanout.sock")
+        # Журнал uvicorn - в файл: непрочитанный pipe остановил бы сервер при заполнении
+        self.log_path = Path(self.workdir.name) / "server.log"
+        with open(self.log_path, "wb") as log:
+            self.process = subprocess.Popen(
+                [sys.executable, str(SERVER_DIR / "main.py")],
+                cwd=self.workdir.name, env=env,
+                stdout=log, stderr=subprocess.STDOUT,
+            )
+
+    async def wait_ready(self, base_url: str, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"server exited:\n{self.log_path.read_text(errors='replace')}")
+                try:
+                    await client.get("/openapi.json")
+                    return
+                except httpx.TransportError:
+                    await asyncio.sleep(0.2)
+        raise RuntimeError("server did not start in time")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.workdir.cleanup()
+
+
+class LoadTest:
+    def __init__(self, base_url: str, args):
+        self.base_url = base_url
+        self.ws_url = base_url.replace("http", "ws", 1)
+        self.args = args
+        self.mix = args.mix
+        self.users = []  # {"id", "token", "sent": [message_id, ...]}
+        self.latencies = {name: [] for name in self.mix}
+        self.errors = {name: 0 for name in self.mix}
+        self.delivery = []
+        self.sent_at = {}  # маркер сообщения -> (время начала отправки, отправлено после прогрева)
+        self.expected_deliveries = 0
+        self.measuring = False
+        self.stopping = False
+
+    async def setup(self, client: httpx.AsyncClient):
+        run_id = uuid.uuid4().hex[:8]
+        semaphore = asyncio.Semaphore(8)
+
+        async def create(index: int):
+            username = f"load_{run_id}_{index}"
+            async with semaphore:
+                response = await client.post("/auth/register", json={"username": username, "password": PASSWORD})
+                response.raise_for_status()
+                user_id = response.json()["id"]
+                response = await client.post("/auth/login", json={"username": username, "password": PASSWORD})
+                response.raise_for_status()
+            return {"id": user_id, "token": response.json()["access_token"], "sent": []}
+
+        self.users = await asyncio.gather(*(create(i) for i in range(self.args.users)))
+
+    async def listen(self, user: dict, ready: asyncio.Event):
+        """Приём событий по WebSocket; задержка доставки считается по маркеру в тексте сообщения"""
+        async with websockets.connect(f"{self.ws_url}/ws/{user['id']}",
+                                      subprotocols=[SUBPROTOCOL, AUTH_PROTOCOL_PREFIX + user["token"]],
+                                      max_size=None) as ws:
+            ready.set()
+            while not self.stopping:
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
+                received = time.perf_counter()
+                frame = json.loads(raw)
+                events = frame["events"] if frame.get("type") == "batch" else [frame]
+                for event in events:
+                    if event.get("type") != "new_message":
+                        continue
+                    message = event["message"]
+                    if message["receiver_id"] != user["id"]:
+                        continue
+                    # Учитываются только сообщения, отправленные после прогрева
+                    started, measured = self.sent_at.pop(message["content"], (None, False))
+                    if measured:
+                        self.delivery.append(received - started)
+
+    async def run_operation(self, client: httpx.AsyncClient, user: dict, operation: str):
+        headers = {"Authorization": f"Bearer {user['token']}"}
+        peer = random.choice([other for other in self.users if other is not user])
+        if operation == "delete" and not user["sent"]:
+            operation = "send"
+
+        started = time.perf_counter()
+        if operation == "send":
+            marker = f"load {uuid.uuid4().hex}"
+            measured = self.measuring
+            self.sent_at[marker] = (started, measured)
+            response = await client.post("/messages/", headers=headers,
+                                         json={"receiver_id": peer["id"], "content": marker})
+            if response.status_code == 200:
+                user["sent"].append(response.json()["id"])
+                if measured:
+                    self.expected_deliveries += 1
+            else:
+                self.sent_at.pop(marker, None)
+        elif operation == "history":
+            response = await client.get("/messages/", headers=headers,
+                                        params={"contact_id": peer["id"], "limit": 50})
+        elif operation == "users":
+            response = await client.get("/users/", headers=headers)
+        else:
+            message_id = user["sent"].pop(random.randrange(len(user["sent"])))
+            response = await client.delete(f"/messages/{message_id}", headers=headers)
+        elapsed = time.perf_counter() - started
+
+        if not self.measuring:
+            return
+        if response.status_code >= 400:
+            self.errors[operation] += 1
+        else:
+            self.latencies[operation].append(elapsed)
+
+    async def worker(self, client: httpx.AsyncClient, user: dict, deadline: float):
+        operations = list(self.mix)
+        weights = [self.mix[name] for name in operations]
+        while time.perf_counter() < deadline:
+            operation = random.choices(operations, weights)[0]
+            try:
+                await self.run_operation(client, user, operation)
+            except httpx.HTTPError:
+                if self.measuring:
+                    self.errors[operation] += 1
+            if self.args.think_ms:
+                await asyncio.sleep(random.uniform(0, 2 * self.args.think_ms) / 1000)
+
+    async def run(self) -> dict:
+        limits = httpx.Limits(max_connections=self.args.users * self.args.concurrency + 10)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=30.0) as client:
+            await self.setup(client)
+
+            ready = [asyncio.Event() for _ in self.users]
+            listeners = [asyncio.create_task(self.listen(user, event)) for user, event in zip(self.users, ready)]
+            await asyncio.wait_for(asyncio.gather(*(event.wait() for event in ready)), timeout=30)
+
+            warmup_end = time.perf_counter() + self.args.warmup
+            deadline = warmup_end + self.args.duration
+            workers = [
+                asyncio.create_task(self.worker(client, user, deadline))
+                for user in self.users for _ in range(self.args.concurrency)
+            ]
+            await asyncio.sleep(max(0.0, warmup_end - time.perf_counter()))
+            self.measuring = True
+            measure_started = time.perf_counter()
+            await asyncio.gather(*workers)
+            measured = time.perf_counter() - measure_started
+
+            # Даём дойти событиям по уже отправленным сообщениям
+            await asyncio.sleep(self.args.drain)
+            self.stopping = True
+            await asyncio.gather(*listeners, return_exceptions=True)
+
+        total = sum(len(values) for values in self.latencies.values())
+        return {
+            "duration_seconds": round(measured, 3),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(total / measured, 1) if measured else 0.0,
+            "operations": {
+                name: dict(summarize(self.latencies[name]), errors=self.errors[name])
+                for name in self.mix
+            },
+            "delivery": dict(summarize(self.delivery), expected=self.expected_deliveries),
+        }
+
+
+def print_report(report: dict):
+    print(f"requests: {report['requests']} in {report['duration_seconds']} s "
+          f"({report['throughput_rps']} req/s), errors: {report['errors']}")
+    print(f"{'operation':<10} {'count':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = list(report["operations"].items()) + [("delivery", report["delivery"])]
+    for name, stats in rows:
+        errors = stats.get("errors", stats.get("expected", 0) - stats["count"])
+        print(f"{name:<10} {stats['count']:>8} {errors:>7} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    packages = {}
+    for name in ("fastapi", "uvicorn", "starlette", "pydantic", "websockets", "httpx", "orjson"):
+        try:
+            packages[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            packages[name] = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "packages": packages,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Messenger server load test")
+    parser.add_argument("--users", type=int, default=20, help="registered users, one WebSocket each")
+    parser.add_argument("--concurrency", type=int, default=1, help="request loops per user")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds before measuring starts")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for in-flight deliveries")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between requests of one loop")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes (>1 uses the fan-out hub)")
+    parser.add_argument("--rate-limits", default="off",
+                        help="MESSENGER_RATE_LIMITS for the started server (default off: measure capacity, not limits)")
+    parser.add_argument("--url", help="use an already running server instead of starting one")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for the operation mix")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+    random.seed(args.seed)
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = ServerProcess(port, args.workers, args.rate_limits)
+        server.start()
+    try:
+        if server is not None:
+            asyncio.run(server.wait_ready(base_url))
+        report = asyncio.run(LoadTest(base_url, args).run())
+    finally:
+        if server is not None:
+            server.stop()
+
+    print_report(report)
+    if args.output:
+        params = {key: value for key, value in vars(args).items() if key not in ("output", "url")}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": params, "environment": environment(), "report": report}, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
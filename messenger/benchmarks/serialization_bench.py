@@ -0,0 +1,96 @@
+"""
+Микробенчмарк сериализации истории сообщений.
+
+Сравнивает прежний путь (MessageResponse на каждую строку, MessagesList,
+jsonable_encoder и стандартный JSONResponse - как делает FastAPI для response_model)
+с быстрым путём serialization.message_rows + FastJSONResponse.
+
+Запуск из каталога messenger:
+    python benchmarks/serialization_bench.py --rows 200 --repeat 500
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from schemas.message import MessageResponse, MessagesList
+from serialization import FastJSONResponse, message_rows, orjson
+
+
+def make_rows(count: int) -> list:
+    rows = []
+    for i in range(count):
+        is_image = i % 10 == 0
+        rows.append({
+            "id": 100000 - i,
+            "sender_id": 1 + i % 2,
+            "receiver_id": 2 - i % 2,
+            "content": "image.png" if is_image else f"Сообщение номер {i}: " + "текст " * 8,
+            "timestamp": f"2026-01-26 11:{i // 60 % 60:02d}:{i % 60:02d}",
+            "is_read": i % 3 == 0,
+            "message_type": "image" if is_image else "text",
+            "file_data": None,
+            "attachment_id": "ab" * 32 if is_image else None,
+            "user_low": 1,
+            "user_high": 2,
+        })
+    return rows
+
+
+def model_path(rows: list) -> bytes:
+    payload = MessagesList(
+        messages=[MessageResponse(**row) for row in rows],
+        total_count=len(rows),
+        has_more=True,
+        next_before_id=rows[-1]["id"]
+    )
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def fast_path(rows: list) -> bytes:
+    return FastJSONResponse({
+        "messages": message_rows(rows),
+        "total_count": len(rows),
+        "has_more": True,
+        "next_before_id": rows[-1]["id"]
+    }).body
+
+
+def measure(func, rows: list, repeat: int) -> float:
+    func(rows)  # Прогрев
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(rows)
+    elapsed = time.perf_counter() - started
+    return len(rows) * repeat / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Message serialization micro-benchmark")
+    parser.add_argument("--rows", type=int, default=200, help="rows per response")
+    parser.add_argument("--repeat", type=int, default=500, help="responses to serialize")
+    args = parser.parse_args(argv)
+
+    rows = make_rows(args.rows)
+    import json
+    before = json.loads(model_path(rows))
+    after = json.loads(fast_path(rows))
+    if before != after:
+        print("⚠️ Fast path output differs from the model path")
+        return 1
+
+    print(f"orjson: {'yes' if orjson else 'no (stdlib json fallback)'}")
+    slow = measure(model_path, rows, args.repeat)
+    fast = measure(fast_path, rows, args.repeat)
+    print(f"model path: {slow:12,.0f} rows/s")
+    print(f"fast path:  {fast:12,.0f} rows/s  (x{fast / slow:.1f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,7 +11,9 @@ class Message:
         timestamp: datetime,
         is_read: bool = False,
         message_type: str = "text",
-        file_data: str = None  # Добавляем поле для хранения данных файла
+        file_data: str = None,  # Добавляем поле для хранения данных файла
+        attachment_id: Optional[str] = None,  # id вложения на сервере (/attachments/{id})
+        thumbnail_url: Optional[str] = None  # Миниатюра изображения для показа в чате
     ):
         self.id = message_id
         self.sender_id = sender_id
@@ -21,6 +23,8 @@ class Message:
         self.is_read = is_read
         self.message_type = message_type
         self.file_data = file_data  # Хранение base64 данных файла
+        self.attachment_id = attachment_id
+        self.thumbnail_url = thumbnail_url
         self.attachments = []
 
     def mark_as_read(self):
@@ -45,6 +49,8 @@ class Message:
             "is_read": self.is_read,
             "message_type": self.message_type,
             "file_data": self.file_data,  # Включаем file_data в сериализацию
+            "attachment_id": self.attachment_id,
+            "thumbnail_url": self.thumbnail_url,
             "attachments": self.attachments
         }
 
@@ -59,7 +65,9 @@ class Message:
             timestamp=timestamp,
             is_read=data.get("is_read", False),
             message_type=data.get("message_type", "text"),
-            file_data=data.get("file_data")  # Важно: получаем file_data из данных
+            file_data=data.get("file_data"),  # Важно: получаем file_data из данных
+            attachment_id=data.get("attachment_id"),
+            thumbnail_url=data.get("thumbnail_url")
         )
         message.attachments = data.get("attachments", [])
         return message
\ No newline at end of file
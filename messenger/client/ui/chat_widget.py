@@ -1,16 +1,68 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTextEdit,
                              QLineEdit, QPushButton, QLabel, QScrollArea, 
                              QMessageBox, QInputDialog, QFileDialog, QMenu)
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal 
-from PyQt5.QtGui import QTextCursor, QPixmap, QTextImageFormat
+from PyQt5.QtCore import Qt, QTimer, QUrl, QObject, pyqtSignal 
+from PyQt5.QtGui import QTextCursor, QPixmap, QTextImageFormat, QDesktopServices
 import requests
 import os
 import base64
 import tempfile
+import time
+import uuid
+from threading import Thread
 from datetime import datetime
 from models.message import Message
 from config import SERVER_URL
 from websocket_client import MessengerWebSocket
+# Попытки отправки сообщения при обрыве связи, таймауте или перегрузке сервера
+SEND_ATTEMPTS = 3
+
+
+class MessageSender(QObject):
+    """
+    POST /messages с повторами в фоновом потоке, чтобы запрос и паузы между
+    попытками не блокировали окно. Результат приходит сигналами в поток интерфейса.
+    """
+    finished = pyqtSignal(object)  # requests.Response
+    failed = pyqtSignal(object)    # Исключение последней попытки
+
+    def __init__(self, payload: dict, headers: dict, timeout: float):
+        super().__init__()
+        self.payload = payload
+        self.headers = headers
+        self.timeout = timeout
+
+    def start(self):
+        Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            self.finished.emit(self._post())
+        except Exception as e:
+            self.failed.emit(e)
+
+    def _post(self):
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            try:
+                response = requests.post(f"{SERVER_URL}/messages", json=self.payload,
+                                         headers=self.headers, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == SEND_ATTEMPTS:
+                    raise
+                print(f"⏳ Send failed, retrying ({attempt}/{SEND_ATTEMPTS})")
+                time.sleep(0.5 * attempt)
+                continue
+            if response.status_code in (429, 503) and attempt < SEND_ATTEMPTS:
+                try:
+                    delay = float(response.headers.get("Retry-After", 1))
+                except ValueError:
+                    delay = 1.0
+                time.sleep(min(delay, 5))
+                continue
+            return response
+        return response
+
+
 class ChatWidget(QWidget):
     # Добавляем сигнал для обновления статуса
     status_updated = pyqtSignal(dict)
@@ -23,21 +75,20 @@ class ChatWidget(QWidget):
         self.contact_label = None  # Сохраняем ссылку на label
         self.messages = []
         self.temp_files = []
+        self.senders = set()  # Отправки в процессе; ссылки держим до их завершения
         self.init_ui()
-        self.load_messages()
-        
-        # Timer for periodic updates
-        self.update_timer = QTimer()
-        self.update_timer.timeout.connect(self.check_new_messages)
-        self.update_timer.start(5000)  # Check every 5 seconds
         
         # Timer для обновления статуса
         self.status_timer = QTimer()
         self.status_timer.timeout.connect(self.update_contact_status)
         self.status_timer.start(10000)  # Обновлять статус каждые 10 секунд
         
-        self.websocket = MessengerWebSocket(current_user["id"])
+        # Новые сообщения приходят через WebSocket, курсор синхронизации -
+        # последнее сообщение из загруженной истории; синхронизируется только этот чат
+        self.websocket = MessengerWebSocket(current_user["id"], auth_token, contact["id"])
         self.websocket.message_received.connect(self.handle_websocket_message)
+        self.load_messages()
+        self.websocket.subscribe([contact["id"]])  # Статус собеседника открытого чата
         self.websocket.connect()
         
         # Подключаем сигнал
@@ -71,6 +122,59 @@ class ChatWidget(QWidget):
         if data.get("type") == "message_deleted":
             message_id = data.get("message_id")
             self._remove_message(message_id)
+        elif data.get("type") == "new_message":
+            self.handle_new_messages([data["message"]])
+        elif data.get("type") == "sync":
+            self.handle_new_messages(data.get("messages", []))
+        elif data.get("type") == "messages_read":
+            self.handle_messages_read(data)
+
+    def handle_new_messages(self, messages_data):
+        """Показ сообщений, доставленных сервером, если они относятся к этому чату"""
+        known_ids = {msg.id for msg in self.messages}
+        last_incoming_id = None
+        for msg_data in messages_data:
+            participants = {msg_data["sender_id"], msg_data["receiver_id"]}
+            if participants != {self.current_user["id"], self.contact["id"]}:
+                continue
+            if msg_data["id"] in known_ids:
+                continue
+            
+            message = Message.from_dict(msg_data)
+            known_ids.add(message.id)
+            self.messages.append(message)
+            self.add_message_to_display(message)
+            if message.sender_id == self.contact["id"] and not message.is_read:
+                last_incoming_id = message.id
+        
+        # Входящие сообщения в открытом чате отмечаем прочитанными одним запросом
+        if last_incoming_id is not None:
+            self.mark_chat_read(last_incoming_id)
+
+    def handle_messages_read(self, data):
+        """Собеседник прочитал наши сообщения до up_to_id"""
+        if data.get("reader_id") != self.contact["id"]:
+            return
+        for message in self.messages:
+            if message.sender_id == self.current_user["id"] and message.id <= data.get("up_to_id", 0):
+                message.mark_as_read()
+
+    def mark_chat_read(self, up_to_id):
+        """Отметить прочитанными входящие сообщения чата до up_to_id"""
+        receipt = {"type": "read", "contact_id": self.contact["id"], "up_to_id": up_to_id}
+        if self.websocket and self.websocket.is_connected:
+            self.websocket.send_message(receipt)
+            return
+        try:
+            headers = {"Authorization": f"Bearer {self.auth_token}"}
+            requests.post(
+                f"{SERVER_URL}/messages/read",
+                json={"contact_id": receipt["contact_id"], "up_to_id": up_to_id},
+                headers=headers,
+                timeout=5
+            )
+        except requests.exceptions.RequestException:
+            pass
             
     def _remove_message(self, message_id):
         """Удаление сообщения из интерфейса"""
@@ -162,34 +266,83 @@ class ChatWidget(QWidget):
         self.messages_area.setContextMenuPolicy(Qt.CustomContextMenu)
         self.messages_area.customContextMenuRequested.connect(self.show_context_menu)
 
+    def post_message(self, payload: dict, on_response, on_failure=None, timeout: float = 10):
+        """
+        Отправка сообщения в фоне; on_response(response) или on_failure(error)
+        вызываются в потоке интерфейса.
+        Все попытки идут с одним client_msg_id, поэтому повтор после таймаута
+        не создаёт дубликат на сервере.
+        """
+        payload = dict(payload, client_msg_id=uuid.uuid4().hex)
+        headers = {
+            "Authorization": f"Bearer {self.auth_token}",
+            "Content-Type": "application/json"
+        }
+        sender = MessageSender(payload, headers, timeout)
+        self.senders.add(sender)
+        sender.finished.connect(on_response)
+        sender.failed.connect(on_failure or self.on_send_failed)
+        sender.finished.connect(lambda _: self.senders.discard(sender))
+        sender.failed.connect(lambda _: self.senders.discard(sender))
+        sender.start()
+
+    def on_send_failed(self, error):
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            QMessageBox.critical(self, "Error", "Cannot connect to server")
+        else:
+            QMessageBox.critical(self, "Error", f"Unexpected error: {str(error)}")
+            print(f"❌ Unexpected error: {error}")
+
+    def on_message_sent(self, response):
+        """Ответ на POST /messages (поток интерфейса)"""
+        print(f"🔧 Debug - Response Status: {response.status_code}")
+        print(f"🔧 Debug - Response Text: {response.text}")
+
+        if response.status_code == 200:
+            # Событие new_message по WebSocket могло прийти раньше ответа
+            self.handle_new_messages([response.json()])
+            print("✅ Message sent successfully!")
+        else:
+            print(f"❌ Failed to send message. Status: {response.status_code}")
+            print(f"❌ Response: {response.text}")
+
+            try:
+                error_detail = response.json().get("detail", "Unknown error")
+                QMessageBox.warning(self, "Error", f"Failed to send message: {error_detail}")
+            except:
+                QMessageBox.warning(self, "Error", f"Failed to send message. Status: {response.status_code}")
+
     def send_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select file", "", "Images (*.png *.jpg *.jpeg *.gif *.bmp)")
         if file_path:
             try:
+                # Файл передаётся потоком как тело запроса (без base64 и чтения целиком в память);
+                # сообщение ссылается на загруженное вложение по attachment_id
                 with open(file_path, "rb") as f:
-                    file_data = base64.b64encode(f.read()).decode('utf-8')
-                
-                headers = {
-                    "Authorization": f"Bearer {self.auth_token}",
-                    "Content-Type": "application/json"
-                }
+                    response = requests.post(
+                        f"{SERVER_URL}/attachments/stream",
+                        data=f,
+                        headers={
+                            "Authorization": f"Bearer {self.auth_token}",
+                            "Content-Type": "application/octet-stream"
+                        },
+                        timeout=120
+                    )
+                if response.status_code == 413:
+                    QMessageBox.warning(self, "Error", "File is too large")
+                    return
+                if response.status_code != 200:
+                    QMessageBox.warning(self, "Error", f"Failed to upload file. Status: {response.status_code}")
+                    return
                 
                 payload = {
                     "content": f"File: {os.path.basename(file_path)}",
                     "receiver_id": self.contact["id"],
                     "message_type": "image",
-                    "file_data": file_data
+                    "attachment_id": response.json()["id"]
                 }
                 
-                response = requests.post(f"{SERVER_URL}/messages", json=payload, headers=headers)
-                
-                if response.status_code == 200:
-                    message_data = response.json()
-                    # Убедимся, что file_data сохраняется в объекте сообщения
-                    message_data["file_data"] = file_data  # Сохраняем данные файла
-                    message = Message.from_dict(message_data)
-                    self.messages.append(message)
-                    self.add_message_to_display(message)
+                self.post_message(payload, self.on_message_sent)
                     
             except Exception as e:
                 QMessageBox.warning(self, "Error", f"Failed to send file: {str(e)}")
@@ -197,10 +350,15 @@ class ChatWidget(QWidget):
     def show_context_menu(self, position):
         menu = QMenu()
         delete_action = menu.addAction("Delete Message")
+        open_image_action = menu.addAction("Open Original Image")
         
         action = menu.exec_(self.messages_area.mapToGlobal(position))
         if action == delete_action:
             self.show_delete_dialog()
+        elif action == open_image_action:
+            message_id, ok = QInputDialog.getInt(self, "Open Image", "Enter message ID:")
+            if ok:
+                self.open_original_image(message_id)
 
     def show_delete_dialog(self):
         message_id, ok = QInputDialog.getInt(self, "Delete Message", "Enter message ID:")
@@ -219,6 +377,13 @@ class ChatWidget(QWidget):
                 messages_data = response.json()["messages"]
                 self.messages = [Message.from_dict(msg) for msg in messages_data]
                 self.display_messages()
+                if self.messages:
+                    self.websocket.advance_cursor(max(msg.id for msg in self.messages))
+                
+                unread_ids = [msg.id for msg in self.messages
+                              if msg.sender_id == self.contact["id"] and not msg.is_read]
+                if unread_ids:
+                    self.mark_chat_read(max(unread_ids))
             else:
                 print("Failed to load messages")
                 
@@ -242,10 +407,9 @@ class ChatWidget(QWidget):
         text_color = "#1976d2" if is_outgoing else "#333333"
         
         # Для изображений создаем временный файл и отображаем картинку
-        if message.message_type == "image" and hasattr(message, 'file_data') and message.file_data:
+        if message.message_type == "image" and (message.file_data or message.attachment_id):
             try:
-                # Декодируем base64 и создаем временный файл
-                image_data = base64.b64decode(message.file_data)
+                image_data = self.load_image_data(message)
                 temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
                 temp_file.write(image_data)
                 temp_file.close()
@@ -288,6 +452,41 @@ class ChatWidget(QWidget):
         
         self.messages_area.ensureCursorVisible()
 
+    def load_image_data(self, message: Message, original: bool = False) -> bytes:
+        """
+        Байты изображения: из base64 в сообщении или загрузкой с сервера.
+        Для показа в чате загружается миниатюра, оригинал - только по запросу.
+        """
+        if message.file_data:
+            return base64.b64decode(message.file_data)
+        
+        if message.thumbnail_url and not original:
+            url = f"{SERVER_URL}{message.thumbnail_url}"
+        else:
+            url = f"{SERVER_URL}/attachments/{message.attachment_id}"
+        
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        response = requests.get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+        return response.content
+
+    def open_original_image(self, message_id):
+        """Загрузка оригинала изображения и открытие его в системном просмотрщике"""
+        message = next((msg for msg in self.messages if msg.id == message_id), None)
+        if not message or message.message_type != "image":
+            QMessageBox.warning(self, "Error", "Image message not found")
+            return
+        
+        try:
+            image_data = self.load_image_data(message, original=True)
+            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
+            temp_file.write(image_data)
+            temp_file.close()
+            self.temp_files.append(temp_file.name)
+            QDesktopServices.openUrl(QUrl.fromLocalFile(temp_file.name))
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Cannot open image: {str(e)}")
+
     def add_text_message(self, message: Message, sender_name: str, alignment: str, bg_color: str, text_color: str):
         """Добавление текстового сообщения с полной информацией"""
         html = f"""
@@ -314,11 +513,6 @@ class ChatWidget(QWidget):
             return
             
         try:
-            headers = {
-                "Authorization": f"Bearer {self.auth_token}",
-                "Content-Type": "application/json"
-            }
-            
             payload = {
                 "content": message_text,
                 "receiver_id": self.contact["id"],
@@ -326,39 +520,27 @@ class ChatWidget(QWidget):
             }
             
             print(f"🔧 Debug - Sending message to: {SERVER_URL}/messages")
-            print(f"🔧 Debug - Headers: {headers}")
             print(f"🔧 Debug - Payload: {payload}")
             print(f"🔧 Debug - Contact ID: {self.contact['id']}")
             
-            response = requests.post(
-                f"{SERVER_URL}/messages",
-                json=payload,
-                headers=headers,
-                timeout=10
-            )
-            
-            print(f"🔧 Debug - Response Status: {response.status_code}")
-            print(f"🔧 Debug - Response Text: {response.text}")
-            
-            if response.status_code == 200:
-                self.message_input.clear()
-                message_data = response.json()
-                message = Message.from_dict(message_data)
-                self.messages.append(message)
-                self.add_message_to_display(message)
-                print("✅ Message sent successfully!")
-            else:
-                print(f"❌ Failed to send message. Status: {response.status_code}")
-                print(f"❌ Response: {response.text}")
-                
-                try:
-                    error_detail = response.json().get("detail", "Unknown error")
-                    QMessageBox.warning(self, "Error", f"Failed to send message: {error_detail}")
-                except:
-                    QMessageBox.warning(self, "Error", f"Failed to send message. Status: {response.status_code}")
+            # Поле очищается сразу; при ошибке текст возвращается, если пользователь не начал новый
+            self.message_input.clear()
+
+            def restore_text():
+                if not self.message_input.text():
+                    self.message_input.setText(message_text)
+
+            def on_response(response):
+                if response.status_code != 200:
+                    restore_text()
+                self.on_message_sent(response)
+
+            def on_failure(error):
+                restore_text()
+                self.on_send_failed(error)
+
+            self.post_message(payload, on_response, on_failure)
                     
-        except requests.exceptions.ConnectionError:
-            QMessageBox.critical(self, "Error", "Cannot connect to server")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Unexpected error: {str(e)}")
             print(f"❌ Unexpected error: {e}")
@@ -420,30 +602,6 @@ class ChatWidget(QWidget):
             print(f"⚠️ Error updating status display: {e}")
     
 
-    def check_new_messages(self):
-        try:
-            headers = {"Authorization": f"Bearer {self.auth_token}"}
-            response = requests.get(
-                f"{SERVER_URL}/messages/unread",
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                unread_messages = response.json()["messages"]
-                for msg_data in unread_messages:
-                    message = Message.from_dict(msg_data)
-                    if message.sender_id == self.contact["id"]:
-                        self.messages.append(message)
-                        self.add_message_to_display(message)
-                        # Mark as read
-                        requests.put(
-                            f"{SERVER_URL}/messages/{message.id}/read",
-                            headers=headers
-                        )
-                        
-        except requests.exceptions.ConnectionError:
-            pass
-            
     def update_contact_status(self):
         """Обновление информации о контакте с сервера"""
         try:
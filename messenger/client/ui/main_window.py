@@ -27,7 +27,7 @@ class MainWindow(QMainWindow):
         """Обновление списка контактов"""
         try:
             headers = {"Authorization": f"Bearer {self.auth_token}"}
-            response = requests.get(f"{SERVER_URL}/users", headers=headers)
+            response = requests.get(f"{SERVER_URL}/conversations", headers=headers)
             
             if response.status_code == 200:
                 updated_contacts = response.json()
@@ -38,8 +38,7 @@ class MainWindow(QMainWindow):
                 # Обновляем отображение в списке
                 self.contacts_list.clear()
                 for user in self.contacts:
-                    status_icon = "🟢" if user["is_online"] else "⚫"
-                    self.contacts_list.addItem(f"{status_icon} {user['username']}")
+                    self.contacts_list.addItem(self.format_contact(user))
                 
                 self.statusBar().showMessage("Contacts updated")
             else:
@@ -105,18 +104,27 @@ class MainWindow(QMainWindow):
         about_action.triggered.connect(self.show_about)
         help_menu.addAction(about_action)
         
+    @staticmethod
+    def format_contact(user):
+        """Строка контакта: статус, имя и число непрочитанных"""
+        status_icon = "🟢" if user["is_online"] else "⚫"
+        text = f"{status_icon} {user['username']}"
+        unread = user.get("unread_count", 0)
+        if unread:
+            text += f" ({unread})"
+        return text
+
     def load_contacts(self):
         try:
             headers = {"Authorization": f"Bearer {self.auth_token}"}
-            response = requests.get(f"{SERVER_URL}/users", headers=headers)
+            response = requests.get(f"{SERVER_URL}/conversations", headers=headers)
             
             if response.status_code == 200:
                 self.contacts = response.json()
                 self.contacts_list.clear()
                 for user in self.contacts:
                     # УБРАНА ПРОВЕРКА - теперь видим всех пользователей включая себя
-                    status_icon = "🟢" if user["is_online"] else "⚫"
-                    self.contacts_list.addItem(f"{status_icon} {user['username']}")
+                    self.contacts_list.addItem(self.format_contact(user))
             else:
                 QMessageBox.warning(self, "Error", "Failed to load contacts")
                 
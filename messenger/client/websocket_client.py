@@ -6,13 +6,23 @@ from PyQt5.QtCore import QObject, pyqtSignal
 import requests
 from config import SERVER_HOST, SERVER_PORT
 
+try:
+    import msgpack
+except ImportError:  # Без msgpack клиент договаривается о JSON
+    msgpack = None
+
+PROTOCOL_MSGPACK = "messenger.v1.msgpack"
+PROTOCOL_JSON = "messenger.v1.json"
+AUTH_PROTOCOL_PREFIX = "messenger.auth."  # JWT в Sec-WebSocket-Protocol
+
 class MessengerWebSocket(QObject):
     message_received = pyqtSignal(dict)  # Сигнал для передачи сообщений в UI
     status_updated = pyqtSignal(dict)    # Сигнал для обновления статусов
     
-    def __init__(self, user_id):
+    def __init__(self, user_id, auth_token, contact_id=None):
         super().__init__()
         self.user_id = user_id
+        self.auth_token = auth_token  # JWT: сервер принимает соединение только с ним
         self.ws = None
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 5
@@ -21,6 +31,10 @@ class MessengerWebSocket(QObject):
         self.server_host = SERVER_HOST
         self.server_port = SERVER_PORT
         self.loop = None
+        self.protocol = None  # Подпротокол, выбранный сервером
+        self.last_message_id = 0  # Курсор синхронизации: id последнего известного сообщения
+        self.contact_id = contact_id  # Синхронизируется только переписка с этим собеседником
+        self.subscriptions = set()  # Пользователи, чьи статусы нужны этому окну
 
     def connect(self):
         """Запускает WebSocket в отдельном потоке"""
@@ -45,28 +59,32 @@ class MessengerWebSocket(QObject):
                 ws_uri = f"ws://{self.server_host}:{self.server_port}/ws/{self.user_id}"
                 print(f"🔌 Connecting to WebSocket: {ws_uri}")
 
+                protocols = [PROTOCOL_MSGPACK, PROTOCOL_JSON] if msgpack else [PROTOCOL_JSON]
+                protocols.append(AUTH_PROTOCOL_PREFIX + self.auth_token)
                 async with websockets.connect(
                     ws_uri, 
+                    subprotocols=protocols,
+                    compression="deflate",
                     ping_interval=20, 
                     ping_timeout=20,
                     close_timeout=5
                 ) as websocket:
                     self.ws = websocket
+                    self.protocol = websocket.subprotocol
                     self.is_connected = True
                     self.reconnect_attempts = 0
                     print("✅ WebSocket connected successfully")
                     
+                    # Запрашиваем сообщения, пропущенные за время отключения
+                    await self._request_sync()
+                    if self.subscriptions:
+                        await self._send_async({"type": "subscribe", "user_ids": sorted(self.subscriptions)})
+                    
                     while self.running:
                         try:
-                            message = await asyncio.wait_for(websocket.recv(), timeout=25)
+                            # Соединение поддерживают ping-кадры WebSocket (ping_interval)
+                            message = await websocket.recv()
                             await self._handle_message(message)
-                        except asyncio.TimeoutError:
-                            # Отправляем ping для поддержания соединения
-                            try:
-                                await websocket.send('ping')
-                            except:
-                                print("⚠️ Failed to send ping")
-                                break
                         except websockets.exceptions.ConnectionClosed as e:
                             print(f"⚠️ WebSocket connection closed: {e}")
                             break
@@ -103,6 +121,7 @@ class MessengerWebSocket(QObject):
             response = requests.post(
                 f"http://{self.server_host}:{self.server_port}/auth/status",
                 json={"user_id": self.user_id, "is_online": False},
+                headers={"Authorization": f"Bearer {self.auth_token}"},
                 timeout=3
             )
             if response.status_code == 200:
@@ -118,21 +137,68 @@ class MessengerWebSocket(QObject):
             if message == 'pong':
                 return
                 
-            data = json.loads(message)
-            print(f"📨 WebSocket received: {data.get('type', 'unknown')}")
-            
-            # Обработка обновления статуса пользователя
-            if data.get("type") == "user_status_update":
-                self.status_updated.emit(data)
+            data = self._decode(message)
+            if data.get("type") == "batch":
+                # Сервер упаковывает накопившиеся события в один кадр
+                for event in data.get("events", []):
+                    await self._dispatch(event)
             else:
-                # Отправляем данные в UI через сигнал
-                self.message_received.emit(data)
+                await self._dispatch(data)
                 
-        except json.JSONDecodeError:
-            print(f"⚠️ Non-JSON message: {message}")
+        except (ValueError, TypeError) as e:
+            print(f"⚠️ Cannot decode message: {e}")
         except Exception as e:
             print(f"⚠️ Error handling message: {e}")
 
+    async def _dispatch(self, data):
+        """Обработка одного события сервера"""
+        print(f"📨 WebSocket received: {data.get('type', 'unknown')}")
+        
+        # Обработка обновления статуса пользователя
+        if data.get("type") == "user_status_update":
+            self.status_updated.emit(data)
+        elif data.get("type") == "new_message":
+            self.advance_cursor(data["message"]["id"])
+            self.message_received.emit(data)
+        elif data.get("type") == "sync":
+            self.advance_cursor(data.get("last_id", 0))
+            self.message_received.emit(data)
+            if data.get("has_more"):
+                await self._request_sync()
+        elif data.get("type") == "error":
+            # Например, rate_limited: сервер отбросил кадры, отправленные слишком часто
+            print(f"⚠️ Server rejected frames: {data.get('code')} (retry after {data.get('retry_after')} s)")
+        else:
+            # Отправляем данные в UI через сигнал
+            self.message_received.emit(data)
+
+    def _encode(self, data):
+        if self.protocol == PROTOCOL_MSGPACK:
+            return msgpack.packb(data, use_bin_type=True)
+        return json.dumps(data)
+
+    def _decode(self, message):
+        if isinstance(message, bytes):
+            return msgpack.unpackb(message, raw=False)
+        return json.loads(message)
+
+    def advance_cursor(self, message_id):
+        if message_id and message_id > self.last_message_id:
+            self.last_message_id = message_id
+
+    async def _request_sync(self):
+        """Запрос сообщений с id больше последнего известного"""
+        request = {"type": "sync", "since_id": self.last_message_id}
+        if self.contact_id is not None:
+            request["contact_id"] = self.contact_id
+        await self.ws.send(self._encode(request))
+
+    def subscribe(self, user_ids):
+        """Подписаться на обновления статуса; повторяется при переподключении"""
+        self.subscriptions.update(user_ids)
+        if self.is_connected and self.ws:
+            self.send_message({"type": "subscribe", "user_ids": sorted(self.subscriptions)})
+
     def send_message(self, data):
         """Отправка сообщения через WebSocket"""
         if self.is_connected and self.ws:
@@ -147,7 +213,7 @@ class MessengerWebSocket(QObject):
     async def _send_async(self, data):
         """Асинхронная отправка сообщения"""
         try:
-            await self.ws.send(json.dumps(data))
+            await self.ws.send(self._encode(data))
             print(f"📤 WebSocket sent: {data.get('type', 'unknown')}")
         except Exception as e:
             print(f"⚠️ Error sending message: {e}")
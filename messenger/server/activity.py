@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from database.repositories import UserRepository
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 5
+
+
+class ActivityTracker:
+    """
+    Время последней активности пользователей в памяти.
+    Накопленные отметки записываются в users.last_seen одним пакетом раз в несколько секунд,
+    вместо UPDATE и commit на каждый запрос.
+    """
+
+    def __init__(self, interval: float = FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flushes = 0
+        self._flushed_rows = 0
+        self._touches = 0
+
+    def touch(self, user_id: int):
+        with self._lock:
+            self._pending[user_id] = datetime.now()
+            self._touches += 1
+
+    async def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            await UserRepository.update_last_seen_many(pending)
+        except Exception as e:
+            logger.error(f"Error flushing last_seen: {e}")
+            # Возвращаем отметки, если за это время не появились более новые
+            with self._lock:
+                for user_id, seen in pending.items():
+                    self._pending.setdefault(user_id, seen)
+            return 0
+        with self._lock:
+            self._flushes += 1
+            self._flushed_rows += len(pending)
+        return len(pending)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "touches": self._touches,
+                "flushes": self._flushes,
+                "flushed_rows": self._flushed_rows,
+                "interval_seconds": self.interval,
+            }
+
+
+activity_tracker = ActivityTracker()
@@ -0,0 +1,185 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+ATTACHMENTS_DIR = Path("attachments")
+CHUNK_SIZE = 64 * 1024
+# Предельный размер вложения; проверяется по мере записи, а не после чтения всего тела
+MAX_ATTACHMENT_SIZE = int(os.environ.get("MESSENGER_MAX_ATTACHMENT_MB", "50")) * 1024 * 1024
+
+_ATTACHMENT_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Сигнатуры поддерживаемых форматов изображений
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+def guess_mime_type(head: bytes) -> str:
+    """Определение типа файла по первым байтам"""
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class AttachmentTooLarge(Exception):
+    """Вложение превысило max_size во время записи"""
+
+
+class AttachmentWriter:
+    """Потоковая запись вложения: хэш и запись на диск по мере поступления данных"""
+
+    def __init__(self, store: "AttachmentStore", max_size: Optional[int] = None):
+        self.store = store
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._head = b""
+        fd, path = tempfile.mkstemp(dir=store.tmp_dir, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+        self._tmp_path = Path(path)
+
+    def write(self, chunk: bytes):
+        if self.max_size is not None and self.size + len(chunk) > self.max_size:
+            raise AttachmentTooLarge(f"Attachment exceeds {self.max_size} bytes")
+        if len(self._head) < 16:
+            self._head += chunk[:16 - len(self._head)]
+        self._hash.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> dict:
+        """Завершить запись; одинаковое содержимое хранится в одном файле"""
+        self._file.close()
+        attachment_id = self._hash.hexdigest()
+        path = self.store.path_for(attachment_id)
+        if path.exists():
+            self._tmp_path.unlink()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self._tmp_path, path)
+        return {
+            "id": attachment_id,
+            "size": self.size,
+            "mime_type": guess_mime_type(self._head),
+        }
+
+    def abort(self):
+        self._file.close()
+        try:
+            self._tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class AttachmentStore:
+    """Контентно-адресуемое хранилище вложений на диске (id = sha256 содержимого)"""
+
+    def __init__(self, root=None):
+        self.root = Path(root or ATTACHMENTS_DIR)
+
+    @property
+    def tmp_dir(self) -> Path:
+        path = self.root / "tmp"
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    @staticmethod
+    def is_valid_id(attachment_id: str) -> bool:
+        return bool(_ATTACHMENT_ID_RE.match(attachment_id or ""))
+
+    def path_for(self, attachment_id: str) -> Path:
+        if not self.is_valid_id(attachment_id):
+            raise ValueError(f"Invalid attachment id: {attachment_id!r}")
+        return self.root / attachment_id[:2] / attachment_id
+
+    def exists(self, attachment_id: str) -> bool:
+        return self.is_valid_id(attachment_id) and self.path_for(attachment_id).exists()
+
+    def delete(self, attachment_id: str) -> int:
+        """Удалить файл вложения; возвращает число освобождённых байт"""
+        path = self.path_for(attachment_id)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        try:
+            path.parent.rmdir()
+        except OSError:
+            pass
+        return size
+
+    def prune_tmp(self, older_than: float) -> int:
+        """Удалить недописанные временные файлы старше older_than секунд; возвращает освобождённые байты"""
+        freed = 0
+        deadline = time.time() - older_than
+        for path in self.tmp_dir.glob("*.part"):
+            try:
+                stat = path.stat()
+                if stat.st_mtime < deadline:
+                    path.unlink()
+                    freed += stat.st_size
+            except FileNotFoundError:
+                continue
+        return freed
+
+    def writer(self, max_size: Optional[int] = None) -> AttachmentWriter:
+        return AttachmentWriter(self, max_size)
+
+    def save_stream(self, stream, max_size: Optional[int] = None) -> dict:
+        """Сохранить содержимое файлового объекта, читая его частями"""
+        writer = self.writer(max_size)
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def save_bytes(self, data: bytes) -> dict:
+        return self.save_stream(io.BytesIO(data))
+
+    def save_base64(self, encoded: str) -> Optional[dict]:
+        """Сохранить данные в base64 (старый формат file_data); None при ошибке декодирования"""
+        try:
+            data = base64.b64decode(encoded, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        return self.save_bytes(data)
+
+    def iter_range(self, attachment_id: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Чтение файла частями в диапазоне [start, end] включительно"""
+        path = self.path_for(attachment_id)
+        with open(path, "rb") as f:
+            if end is None:
+                end = os.fstat(f.fileno()).st_size - 1
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+attachment_store = AttachmentStore()
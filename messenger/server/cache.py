@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+TOKEN_CACHE_SIZE = 4096
+TOKEN_CACHE_TTL = 300
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60
+DIRECTORY_CACHE_TTL = 300
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_CACHE_TTL = 24 * 60 * 60
+
+
+class TTLCache:
+    """Ограниченный по размеру кэш с временем жизни записей (вытеснение LRU)"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._evicted += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evicted": self._evicted,
+            }
+
+
+# Токен -> id пользователя (не дольше срока действия токена)
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+# id пользователя -> строка users; сбрасывается при изменении пользователя
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# Список всех пользователей для GET /users; сбрасывается при регистрации
+directory_cache = TTLCache(1, DIRECTORY_CACHE_TTL)
+# (id отправителя, client_msg_id) -> созданная строка messages; повтор отправки без обращения к БД
+idempotency_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL)
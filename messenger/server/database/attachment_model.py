@@ -0,0 +1,47 @@
+from database.db import get_connection
+from typing import Optional
+
+class AttachmentModel:
+    @staticmethod
+    def register(attachment_id: str, size: int, mime_type: str, user_id: int) -> dict:
+        """
+        Запись о вложении; повторная загрузка того же содержимого не создаёт дубликат,
+        но обновляет created_at, чтобы обслуживание не удалило файл до отправки сообщения.
+        Загрузивший пользователь получает доступ к вложению
+        """
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO attachments (id, size, mime_type) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET created_at = CURRENT_TIMESTAMP
+            """, (attachment_id, size, mime_type))
+            cursor.execute("""
+                INSERT OR IGNORE INTO attachment_uploads (attachment_id, user_id) VALUES (?, ?)
+            """, (attachment_id, user_id))
+            conn.commit()
+            cursor.execute("SELECT * FROM attachments WHERE id = ?", (attachment_id,))
+            row = cursor.fetchone()
+        return dict(row)
+
+    @staticmethod
+    def get_attachment(attachment_id: str) -> Optional[dict]:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM attachments WHERE id = ?", (attachment_id,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def can_access(attachment_id: str, user_id: int) -> bool:
+        """Пользователь загружал вложение или участвует в переписке, где оно отправлено"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM attachment_uploads WHERE attachment_id = ? AND user_id = ?
+                ) OR EXISTS (
+                    SELECT 1 FROM messages
+                    WHERE attachment_id = ? AND (sender_id = ? OR receiver_id = ?)
+                )
+            """, (attachment_id, user_id, attachment_id, user_id, user_id))
+            return bool(cursor.fetchone()[0])
@@ -0,0 +1,131 @@
+from database.db import get_connection
+from typing import List
+
+# Сводка по перепискам: одна строка на участника и собеседника.
+# Методы on_* вызываются внутри транзакций MessageModel, чтобы счётчики
+# менялись атомарно вместе с таблицей messages.
+
+class ConversationModel:
+    @staticmethod
+    def on_message_created(cursor, message_id: int, sender_id: int, receiver_id: int):
+        """Новое сообщение: последнее сообщение для обоих, +1 непрочитанное у получателя"""
+        for user_id, peer_id, unread in ((sender_id, receiver_id, 0), (receiver_id, sender_id, 1)):
+            cursor.execute("""
+                INSERT INTO conversation_state (user_id, peer_id, unread_count, last_message_id, last_timestamp)
+                SELECT ?, ?, ?, id, timestamp FROM messages WHERE id = ?
+                ON CONFLICT (user_id, peer_id) DO UPDATE SET
+                    unread_count = unread_count + excluded.unread_count,
+                    last_message_id = excluded.last_message_id,
+                    last_timestamp = excluded.last_timestamp
+            """, (user_id, peer_id, unread, message_id))
+
+    @staticmethod
+    def on_messages_read(cursor, reader_id: int, peer_id: int, count: int):
+        """Прочитано count входящих сообщений от peer_id"""
+        if count <= 0:
+            return
+        cursor.execute("""
+            UPDATE conversation_state SET unread_count = MAX(unread_count - ?, 0)
+            WHERE user_id = ? AND peer_id = ?
+        """, (count, reader_id, peer_id))
+
+    @staticmethod
+    def on_message_deleted(cursor, message: dict):
+        """Удалённое сообщение: поправить счётчик и последнее сообщение переписки"""
+        sender_id, receiver_id = message["sender_id"], message["receiver_id"]
+        if not message["is_read"]:
+            ConversationModel.on_messages_read(cursor, receiver_id, sender_id, 1)
+
+        cursor.execute("""
+            SELECT id, timestamp FROM messages
+            WHERE user_low = ? AND user_high = ?
+            ORDER BY id DESC LIMIT 1
+        """, (min(sender_id, receiver_id), max(sender_id, receiver_id)))
+        last = cursor.fetchone()
+        cursor.execute("""
+            UPDATE conversation_state SET last_message_id = ?, last_timestamp = ?
+            WHERE ((user_id = ? AND peer_id = ?) OR (user_id = ? AND peer_id = ?))
+              AND last_message_id = ?
+        """, (
+            last["id"] if last else None,
+            last["timestamp"] if last else None,
+            sender_id, receiver_id, receiver_id, sender_id,
+            message["id"]
+        ))
+
+    @staticmethod
+    def refresh(cursor, pairs):
+        """Пересчитать счётчики и последнее сообщение для пар после массового удаления"""
+        for user_a, user_b in pairs:
+            cursor.execute("""
+                SELECT id, timestamp FROM messages
+                WHERE user_low = ? AND user_high = ?
+                ORDER BY id DESC LIMIT 1
+            """, (min(user_a, user_b), max(user_a, user_b)))
+            last = cursor.fetchone()
+            for user_id, peer_id in ((user_a, user_b), (user_b, user_a)):
+                cursor.execute("""
+                    UPDATE conversation_state SET
+                        unread_count = (
+                            SELECT COUNT(*) FROM messages
+                            WHERE receiver_id = ? AND is_read = FALSE AND sender_id = ?
+                        ),
+                        last_message_id = ?,
+                        last_timestamp = ?
+                    WHERE user_id = ? AND peer_id = ?
+                """, (
+                    user_id, peer_id,
+                    last["id"] if last else None,
+                    last["timestamp"] if last else None,
+                    user_id, peer_id
+                ))
+
+    @staticmethod
+    def repair_unread_counts() -> int:
+        """Исправить разошедшиеся счётчики непрочитанных; возвращает число исправленных строк"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE conversation_state SET unread_count = (
+                    SELECT COUNT(*) FROM messages
+                    WHERE receiver_id = conversation_state.user_id AND is_read = FALSE
+                      AND sender_id = conversation_state.peer_id
+                )
+                WHERE unread_count != (
+                    SELECT COUNT(*) FROM messages
+                    WHERE receiver_id = conversation_state.user_id AND is_read = FALSE
+                      AND sender_id = conversation_state.peer_id
+                )
+            """)
+            fixed = cursor.rowcount
+            conn.commit()
+        return fixed
+
+    @staticmethod
+    def get_peer_ids(user_id: int) -> List[int]:
+        """Собеседники пользователя (для подписки на их статусы)"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT peer_id FROM conversation_state WHERE user_id = ?", (user_id,))
+            peer_ids = [row["peer_id"] for row in cursor.fetchall()]
+        return peer_ids
+
+    @staticmethod
+    def get_conversations(user_id: int) -> List[dict]:
+        """Контакты пользователя со счётчиком непрочитанных и последним сообщением"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT u.id, u.username, u.is_online, u.status, u.last_seen,
+                       COALESCE(cs.unread_count, 0) AS unread_count,
+                       cs.last_message_id, cs.last_timestamp,
+                       m.sender_id AS last_sender_id,
+                       m.message_type AS last_message_type,
+                       substr(m.content, 1, 100) AS last_message_preview
+                FROM users u
+                LEFT JOIN conversation_state cs ON cs.user_id = ? AND cs.peer_id = u.id
+                LEFT JOIN messages m ON m.id = cs.last_message_id
+                ORDER BY u.id
+            """, (user_id,))
+            conversations = [dict(row) for row in cursor.fetchall()]
+        return conversations
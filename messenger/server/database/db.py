@@ -1,47 +1,375 @@
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
 DB_PATH = Path("messenger.db")
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Настройки пула соединений
+POOL_MAX_SIZE = 8
+POOL_TIMEOUT = 30.0
+STATEMENT_CACHE_SIZE = 256
+
+
+def open_connection(db_path=None):
+    """Открытие нового соединения с настроенными PRAGMA"""
+    conn = sqlite3.connect(
+        db_path or DB_PATH,
+        timeout=POOL_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
     conn.row_factory = sqlite3.Row
+    # Новая база создаётся с auto_vacuum=INCREMENTAL (должно идти до перевода в WAL);
+    # существующая переводится только полным VACUUM, см. manage.py maintenance --full-vacuum
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL позволяет читателям не блокировать писателя и наоборот,
+    # а synchronous=NORMAL в режиме WAL убирает fsync на каждый коммит
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
     return conn
 
-def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            is_online BOOLEAN DEFAULT FALSE,
-            last_seen DATETIME,
-            status TEXT DEFAULT 'offline',
-            is_admin BOOLEAN DEFAULT FALSE,
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite с повторным использованием внутри потока"""
+
+    def __init__(self, db_path=None, max_size: int = POOL_MAX_SIZE, timeout: float = POOL_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._created = 0
+        self._lock = threading.Condition()
+        self._local = threading.local()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._reuses = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        """Взять соединение из пула (при исчерпании пула ждём освобождения)"""
+        with self._lock:
+            self._checkouts += 1
+            if not self._idle and self._created >= self.max_size:
+                self._waits += 1
+                started = time.monotonic()
+                deadline = started + self.timeout
+                while not self._idle:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("Timed out waiting for a database connection")
+                    self._lock.wait(remaining)
+                self._wait_time += time.monotonic() - started
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return open_connection(self.db_path)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        """Вернуть соединение в пул, откатив незавершённую транзакцию"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+                self._lock.notify()
+            return
+        with self._lock:
+            self._idle.append(conn)
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Контекстный менеджер соединения.
+        Вложенные вызовы в одном потоке получают то же соединение.
+        """
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None:
+            local.depth += 1
+            with self._lock:
+                self._reuses += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+
+        conn = self.acquire()
+        local.conn = conn
+        local.depth = 1
+        try:
+            yield conn
+        finally:
+            local.conn = None
+            local.depth = 0
+            self.release(conn)
+
+    def close_all(self):
+        """Закрыть все свободные соединения (при остановке сервера)"""
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+                self._created -= 1
+
+    def stats(self) -> dict:
+        """Счётчики пула"""
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "created": self._created,
+                "idle": len(self._idle),
+                "in_use": self._created - len(self._idle),
+                "checkouts": self._checkouts,
+                "reuses": self._reuses,
+                "waits": self._waits,
+                "wait_time_seconds": round(self._wait_time, 6),
+            }
+
+
+pool = ConnectionPool()
+
+
+def get_connection():
+    """Соединение из общего пула: with get_connection() as conn: ..."""
+    return pool.connection()
+
+
+def _migration_conversation_index(cursor):
+    """Нормализованный ключ переписки и индексы для истории и непрочитанных"""
+    # Пара (user_low, user_high) одинакова для сообщений в обе стороны,
+    # поэтому вместо OR по двум направлениям достаточно одного диапазона индекса
+    cursor.execute("""
+        ALTER TABLE messages ADD COLUMN user_low INTEGER
+        GENERATED ALWAYS AS (min(sender_id, receiver_id)) VIRTUAL
+    """)
+    cursor.execute("""
+        ALTER TABLE messages ADD COLUMN user_high INTEGER
+        GENERATED ALWAYS AS (max(sender_id, receiver_id)) VIRTUAL
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation
+        ON messages (user_low, user_high, id)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_unread
+        ON messages (receiver_id, is_read, id)
+    """)
+
+
+def _migration_attachments(cursor):
+    """Вложения хранятся вне таблицы messages, сообщение ссылается на них по id"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS attachments (
+            id TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mime_type TEXT NOT NULL DEFAULT 'application/octet-stream',
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    
-    # Messages table - добавляем колонку file_data
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_id INTEGER NOT NULL,
-            receiver_id INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            message_type TEXT DEFAULT 'text',
-            file_data TEXT,
-            is_read BOOLEAN DEFAULT FALSE,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (sender_id) REFERENCES users (id),
-            FOREIGN KEY (receiver_id) REFERENCES users (id)
+    cursor.execute("ALTER TABLE messages ADD COLUMN attachment_id TEXT REFERENCES attachments (id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_attachment ON messages (attachment_id)")
+
+    # Переносим уже сохранённые base64-данные в хранилище вложений
+    from attachment_store import attachment_store
+    cursor.execute("SELECT id, file_data FROM messages WHERE file_data IS NOT NULL")
+    for row in cursor.fetchall():
+        attachment = attachment_store.save_base64(row["file_data"])
+        if attachment is None:
+            continue
+        cursor.execute("""
+            INSERT OR IGNORE INTO attachments (id, size, mime_type) VALUES (?, ?, ?)
+        """, (attachment["id"], attachment["size"], attachment["mime_type"]))
+        cursor.execute(
+            "UPDATE messages SET attachment_id = ?, file_data = NULL WHERE id = ?",
+            (attachment["id"], row["id"])
+        )
+
+
+def _migration_search_index(cursor):
+    """Полнотекстовый индекс FTS5 по тексту сообщений, синхронизируемый триггерами"""
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    # Индексируем уже существующие сообщения: триггер удаления ожидает, что строка есть в индексе
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+def _migration_participant_indexes(cursor):
+    """Индексы по участнику и id для синхронизации после переподключения"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages (receiver_id, id)")
+
+
+def _migration_conversation_state(cursor):
+    """Денормализованная сводка по перепискам: непрочитанные и последнее сообщение"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            user_id INTEGER NOT NULL,
+            peer_id INTEGER NOT NULL,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            last_message_id INTEGER,
+            last_timestamp DATETIME,
+            PRIMARY KEY (user_id, peer_id)
+        ) WITHOUT ROWID
+    """)
+    # Заполняем по существующим сообщениям: сторона отправителя и сторона получателя
+    cursor.execute("""
+        INSERT INTO conversation_state (user_id, peer_id, unread_count, last_message_id)
+        SELECT user_id, peer_id, SUM(unread), MAX(id) FROM (
+            SELECT sender_id AS user_id, receiver_id AS peer_id, id, 0 AS unread FROM messages
+            UNION ALL
+            SELECT receiver_id, sender_id, id, CASE WHEN is_read THEN 0 ELSE 1 END FROM messages
+        )
+        GROUP BY user_id, peer_id
+    """)
+    cursor.execute("""
+        UPDATE conversation_state SET last_timestamp = (
+            SELECT timestamp FROM messages WHERE messages.id = conversation_state.last_message_id
         )
     """)
 
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+
+def _migration_timestamp_index(cursor):
+    """Индекс по времени для архивации старых сообщений и выгрузки за период"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+
+
+def _migration_client_msg_id(cursor):
+    """Ключ идемпотентности отправки: повтор с тем же client_msg_id не создаёт дубликат"""
+    cursor.execute("ALTER TABLE messages ADD COLUMN client_msg_id TEXT")
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_client_msg
+        ON messages (sender_id, client_msg_id) WHERE client_msg_id IS NOT NULL
+    """)
+
+
+def _migration_attachment_uploads(cursor):
+    """Кто загружал вложение: скачать или отправить его может только загрузивший или участник переписки с ним"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS attachment_uploads (
+            attachment_id TEXT NOT NULL REFERENCES attachments (id),
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (attachment_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    # Для уже отправленных вложений загрузившим считаем отправителя сообщения
+    cursor.execute("""
+        INSERT OR IGNORE INTO attachment_uploads (attachment_id, user_id)
+        SELECT DISTINCT attachment_id, sender_id FROM messages WHERE attachment_id IS NOT NULL
+    """)
+
+
+def rebuild_search_index():
+    """Перестроить полнотекстовый индекс по всем сообщениям (если он разошёлся с таблицей)"""
+    with get_connection() as conn:
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        conn.commit()
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+        conn.commit()
+        return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+# Миграции схемы по порядку; номер применённой миграции хранится в PRAGMA user_version
+MIGRATIONS = [
+    _migration_conversation_index,
+    _migration_attachments,
+    _migration_search_index,
+    _migration_participant_indexes,
+    _migration_conversation_state,
+    _migration_timestamp_index,
+    _migration_client_msg_id,
+    _migration_attachment_uploads,
+]
+
+
+def migrate(conn):
+    """Применить недостающие миграции схемы"""
+    while True:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            return
+        cursor = conn.cursor()
+        try:
+            # Явная транзакция, чтобы DDL миграции применялся целиком или не применялся.
+            # IMMEDIATE и повторная проверка версии - на случай одновременного запуска нескольких процессов
+            cursor.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != version:
+                conn.rollback()
+                continue
+            MIGRATIONS[version](cursor)
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def init_db():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        # Users table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                is_online BOOLEAN DEFAULT FALSE,
+                last_seen DATETIME,
+                status TEXT DEFAULT 'offline',
+                is_admin BOOLEAN DEFAULT FALSE,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Messages table - добавляем колонку file_data
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id INTEGER NOT NULL,
+                receiver_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                message_type TEXT DEFAULT 'text',
+                file_data TEXT,
+                is_read BOOLEAN DEFAULT FALSE,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (sender_id) REFERENCES users (id),
+                FOREIGN KEY (receiver_id) REFERENCES users (id)
+            )
+        """)
+
+        conn.commit()
+        migrate(conn)
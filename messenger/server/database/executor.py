@@ -0,0 +1,56 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Число потоков для чтения. В режиме WAL читатели не мешают друг другу и писателю,
+# поэтому долгий запрос (например, /admin/all-messages) занимает только один поток.
+READ_WORKERS = 4
+
+
+class DatabaseExecutor:
+    """Выполнение блокирующих запросов SQLite вне потока event loop"""
+
+    def __init__(self, read_workers: int = READ_WORKERS):
+        self.read_workers = read_workers
+        self._readers = None
+        self._writer = None
+
+    def start(self):
+        if self._readers is None:
+            self._readers = ThreadPoolExecutor(max_workers=self.read_workers, thread_name_prefix="db-read")
+        if self._writer is None:
+            # SQLite допускает одного писателя, поэтому все записи идут через один поток
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+    def shutdown(self):
+        if self._readers is not None:
+            self._readers.shutdown(wait=True)
+            self._readers = None
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    async def _run(self, executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    async def read(self, func, *args, **kwargs):
+        """Выполнить читающий запрос в пуле читателей"""
+        self.start()
+        return await self._run(self._readers, func, *args, **kwargs)
+
+    async def write(self, func, *args, **kwargs):
+        """Выполнить пишущий запрос в потоке писателя"""
+        self.start()
+        return await self._run(self._writer, func, *args, **kwargs)
+
+    def stats(self) -> dict:
+        """Глубина очередей запросов"""
+        return {
+            "read_workers": self.read_workers,
+            "read_queue": self._readers._work_queue.qsize() if self._readers else 0,
+            "write_queue": self._writer._work_queue.qsize() if self._writer else 0,
+        }
+
+
+db_executor = DatabaseExecutor()
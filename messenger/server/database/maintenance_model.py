@@ -0,0 +1,183 @@
+from database.db import get_connection, open_connection
+from database.conversation_model import ConversationModel
+from typing import List, Optional
+
+# Колонки, переносимые в архив (сгенерированные user_low/user_high не копируются)
+ARCHIVE_COLUMNS = ("id", "sender_id", "receiver_id", "content", "message_type",
+                   "file_data", "attachment_id", "is_read", "timestamp", "client_msg_id")
+
+# Обслуживание базы: перенос старых сообщений в помесячные архивы,
+# удаление осиротевших вложений, incremental VACUUM и ANALYZE.
+# Архивные базы подключаются через ATTACH на отдельном соединении,
+# чтобы не менять состояние соединений пула.
+
+class MaintenanceModel:
+    @staticmethod
+    def database_size() -> dict:
+        """Размер базы в страницах и байтах, число свободных страниц"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+            page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+            freelist_count = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = cursor.execute("PRAGMA auto_vacuum").fetchone()[0]
+        return {
+            "page_size": page_size,
+            "page_count": page_count,
+            "freelist_count": freelist_count,
+            "bytes": page_size * page_count,
+            "free_bytes": page_size * freelist_count,
+            # 0 - NONE, 1 - FULL, 2 - INCREMENTAL
+            "auto_vacuum": auto_vacuum,
+        }
+
+    @staticmethod
+    def oldest_message_before(cutoff: str) -> Optional[str]:
+        """Время самого старого сообщения раньше cutoff (None - архивировать нечего)"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(timestamp) FROM messages WHERE timestamp < ?", (cutoff,))
+            row = cursor.fetchone()
+        return row[0]
+
+    @staticmethod
+    def archive_batch(archive_path: str, since: str, until: str, batch_size: int) -> int:
+        """
+        Перенести до batch_size сообщений с timestamp в [since, until) в архивную базу.
+        При WAL коммит не атомарен между базами, поэтому копирование идёт через
+        INSERT OR IGNORE: после сбоя повтор просто удалит уже скопированные строки.
+        """
+        columns = ", ".join(ARCHIVE_COLUMNS)
+        conn = open_connection()
+        try:
+            conn.execute("ATTACH DATABASE ? AS archive", (str(archive_path),))
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS archive.messages (
+                        id INTEGER PRIMARY KEY,
+                        sender_id INTEGER NOT NULL,
+                        receiver_id INTEGER NOT NULL,
+                        content TEXT NOT NULL,
+                        message_type TEXT,
+                        file_data TEXT,
+                        attachment_id TEXT,
+                        is_read BOOLEAN,
+                        timestamp DATETIME,
+                        client_msg_id TEXT
+                    )
+                """)
+                # Архивы, созданные до появления client_msg_id
+                archive_columns = {row["name"] for row in cursor.execute("PRAGMA archive.table_info(messages)")}
+                if "client_msg_id" not in archive_columns:
+                    cursor.execute("ALTER TABLE archive.messages ADD COLUMN client_msg_id TEXT")
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS archive.idx_archive_conversation
+                    ON messages (sender_id, receiver_id, id)
+                """)
+                conn.commit()
+
+                cursor.execute("""
+                    SELECT id, sender_id, receiver_id FROM messages
+                    WHERE timestamp >= ? AND timestamp < ?
+                    ORDER BY timestamp LIMIT ?
+                """, (since, until, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    return 0
+
+                ids = [row["id"] for row in rows]
+                placeholders = ", ".join("?" * len(ids))
+                cursor.execute(f"""
+                    INSERT OR IGNORE INTO archive.messages ({columns})
+                    SELECT {columns} FROM main.messages WHERE id IN ({placeholders})
+                """, ids)
+                cursor.execute(f"DELETE FROM main.messages WHERE id IN ({placeholders})", ids)
+
+                pairs = {(min(row["sender_id"], row["receiver_id"]), max(row["sender_id"], row["receiver_id"]))
+                         for row in rows}
+                ConversationModel.refresh(cursor, pairs)
+                conn.commit()
+                return len(ids)
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute("DETACH DATABASE archive")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def prune_orphan_attachments(created_before: str, archive_paths: List[str]) -> List[dict]:
+        """
+        Удалить записи о вложениях, на которые не ссылается ни одно сообщение
+        (в том числе архивное). Возвращает удалённые записи для очистки файлов.
+        """
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT a.id, a.size FROM attachments a
+                WHERE a.created_at < ?
+                  AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.attachment_id = a.id)
+            """, (created_before,))
+            candidates = {row["id"]: dict(row) for row in cursor.fetchall()}
+
+        if candidates and archive_paths:
+            conn = open_connection()
+            try:
+                for path in archive_paths:
+                    conn.execute("ATTACH DATABASE ? AS archive", (str(path),))
+                    try:
+                        cursor = conn.execute(
+                            "SELECT DISTINCT attachment_id FROM archive.messages WHERE attachment_id IS NOT NULL"
+                        )
+                        for row in cursor.fetchall():
+                            candidates.pop(row[0], None)
+                    finally:
+                        conn.execute("DETACH DATABASE archive")
+            finally:
+                conn.close()
+
+        if not candidates:
+            return []
+
+        pruned = []
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for attachment_id, attachment in candidates.items():
+                # Повторная проверка: ссылка могла появиться после выборки
+                cursor.execute("""
+                    DELETE FROM attachments WHERE id = ? AND created_at < ?
+                      AND NOT EXISTS (SELECT 1 FROM messages WHERE attachment_id = ?)
+                """, (attachment_id, created_before, attachment_id))
+                if cursor.rowcount:
+                    cursor.execute("DELETE FROM attachment_uploads WHERE attachment_id = ?", (attachment_id,))
+                    pruned.append(attachment)
+            conn.commit()
+        return pruned
+
+    @staticmethod
+    def incremental_vacuum(pages: int) -> int:
+        """Вернуть системе до pages свободных страниц; возвращает остаток freelist"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # PRAGMA incremental_vacuum выполняется по мере чтения результата
+            cursor.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            conn.commit()
+            remaining = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        return remaining
+
+    @staticmethod
+    def full_vacuum():
+        """Полный VACUUM с переводом базы в auto_vacuum=INCREMENTAL (блокирует базу)"""
+        with get_connection() as conn:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+    @staticmethod
+    def analyze():
+        """Обновить статистику планировщика; analysis_limit ограничивает время на больших таблицах"""
+        with get_connection() as conn:
+            conn.execute("PRAGMA analysis_limit = 1000")
+            conn.execute("ANALYZE")
+            conn.commit()
@@ -1,67 +1,283 @@
 from datetime import datetime
-from database.db import get_db_connection
-from typing import List, Optional
+from metrics import timed_queries
+from database.db import get_connection, open_connection
+from database.conversation_model import ConversationModel
+from typing import Iterator, List, Optional
+import re
 
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ("id", "sender_id", "receiver_id", "content", "timestamp", "is_read",
+                  "message_type", "attachment_id")
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """Безопасный запрос FTS5 из пользовательского текста: все слова, с поиском по префиксу"""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+@timed_queries
 class MessageModel:
     @staticmethod
-    def create_message(sender_id: int, receiver_id: int, content: str, 
-                     message_type: str = "text", file_data: Optional[str] = None) -> int:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO messages (sender_id, receiver_id, content, message_type, file_data)
-            VALUES (?, ?, ?, ?, ?)
-        """, (sender_id, receiver_id, content, message_type, file_data))
-        
-        message_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return message_id
+    def create_message(sender_id: int, receiver_id: int, content: str,
+                     message_type: str = "text", attachment_id: Optional[str] = None,
+                     client_msg_id: Optional[str] = None) -> int:
+        rows = MessageModel.create_messages(
+            [(sender_id, receiver_id, content, message_type, attachment_id, client_msg_id)]
+        )
+        return rows[0]["id"]
 
     @staticmethod
-    def get_messages_between_users(user1_id: int, user2_id: int, limit: int = 100) -> List[dict]:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM messages 
-            WHERE (sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?)
-            ORDER BY timestamp DESC LIMIT ?
-        """, (user1_id, user2_id, user2_id, user1_id, limit))
-        
-        messages = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+    def create_messages(messages: List[tuple]) -> List[dict]:
+        """
+        Вставка пачки сообщений одной транзакцией (один fsync на пачку).
+        messages - кортежи (sender_id, receiver_id, content, message_type, attachment_id, client_msg_id);
+        возвращает строки в том же порядке. Если сообщение с таким client_msg_id
+        у отправителя уже есть, возвращается существующая строка с replayed=True.
+        """
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            rows = []
+            for sender_id, receiver_id, content, message_type, attachment_id, client_msg_id in messages:
+                cursor.execute("""
+                    INSERT INTO messages (sender_id, receiver_id, content, message_type, attachment_id, client_msg_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (sender_id, client_msg_id) WHERE client_msg_id IS NOT NULL DO NOTHING
+                    RETURNING id, sender_id, receiver_id, content, timestamp, is_read,
+                              message_type, file_data, attachment_id, client_msg_id
+                """, (sender_id, receiver_id, content, message_type, attachment_id, client_msg_id))
+                row = cursor.fetchone()
+                if row is None:
+                    # Повтор отправки (в том числе в той же пачке): отдаём исходное сообщение
+                    cursor.execute("""
+                        SELECT id, sender_id, receiver_id, content, timestamp, is_read,
+                               message_type, file_data, attachment_id, client_msg_id
+                        FROM messages WHERE sender_id = ? AND client_msg_id = ?
+                    """, (sender_id, client_msg_id))
+                    row = dict(cursor.fetchone())
+                    row["replayed"] = True
+                else:
+                    row = dict(row)
+                    row["replayed"] = False
+                    ConversationModel.on_message_created(cursor, row["id"], sender_id, receiver_id)
+                rows.append(row)
+            conn.commit()
+        return rows
+
+    @staticmethod
+    def get_message(message_id: int) -> Optional[dict]:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM messages WHERE id = ?", (message_id,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def get_messages_between_users(user1_id: int, user2_id: int, limit: int = 100,
+                                   before_id: Optional[int] = None,
+                                   after_id: Optional[int] = None) -> List[dict]:
+        """
+        Страница переписки по индексу idx_messages_conversation (новые сообщения первыми).
+        before_id/after_id - курсоры keyset-пагинации по id сообщения.
+        """
+        conditions = ["user_low = ?", "user_high = ?"]
+        params = [min(user1_id, user2_id), max(user1_id, user2_id)]
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+
+        # Для after_id идём вперёд от курсора, иначе назад от самых новых
+        order = "ASC" if after_id is not None and before_id is None else "DESC"
+        params.append(limit)
+
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(f"""
+                SELECT * FROM messages
+                WHERE {" AND ".join(conditions)}
+                ORDER BY id {order} LIMIT ?
+            """, params)
+
+            messages = [dict(row) for row in cursor.fetchall()]
+        if order == "ASC":
+            messages.reverse()
+        return messages
+
+    @staticmethod
+    def get_messages_since(user_id: int, since_id: int, limit: int = 500,
+                           contact_id: Optional[int] = None) -> List[dict]:
+        """
+        Сообщения пользователя (входящие и исходящие) с id больше since_id, по возрастанию id;
+        с contact_id - только переписка с этим собеседником
+        """
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if contact_id is not None:
+                cursor.execute("""
+                    SELECT * FROM messages
+                    WHERE user_low = ? AND user_high = ? AND id > ?
+                    ORDER BY id LIMIT ?
+                """, (min(user_id, contact_id), max(user_id, contact_id), since_id, limit))
+                return [dict(row) for row in cursor.fetchall()]
+            # UNION вместо OR, чтобы каждая половина шла по своему индексу
+            cursor.execute("""
+                SELECT * FROM (
+                    SELECT * FROM messages WHERE receiver_id = ? AND id > ?
+                    UNION
+                    SELECT * FROM messages WHERE sender_id = ? AND id > ?
+                )
+                ORDER BY id LIMIT ?
+            """, (user_id, since_id, user_id, since_id, limit))
+            messages = [dict(row) for row in cursor.fetchall()]
+        return messages
+
+    @staticmethod
+    def search_messages(user_id: int, text: str, contact_id: Optional[int] = None,
+                        limit: int = 20, offset: int = 0) -> List[dict]:
+        """Полнотекстовый поиск по переписке пользователя, лучшие совпадения первыми"""
+        match_query = build_match_query(text)
+        if not match_query:
+            return []
+
+        conditions = ["messages_fts MATCH ?"]
+        params = [match_query]
+        if contact_id is not None:
+            conditions.append("m.user_low = ? AND m.user_high = ?")
+            params += [min(user_id, contact_id), max(user_id, contact_id)]
+        else:
+            conditions.append("(m.sender_id = ? OR m.receiver_id = ?)")
+            params += [user_id, user_id]
+        params += [limit, offset]
+
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT m.id, m.sender_id, m.receiver_id, m.content, m.message_type,
+                       m.attachment_id, m.is_read, m.timestamp,
+                       snippet(messages_fts, 0, '<b>', '</b>', '…', 12) AS snippet,
+                       bm25(messages_fts) AS rank
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE {" AND ".join(conditions)}
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            """, params)
+            messages = [dict(row) for row in cursor.fetchall()]
         return messages
 
     @staticmethod
     def get_unread_messages(user_id: int) -> List[dict]:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT * FROM messages WHERE receiver_id = ? AND is_read = FALSE
-        """, (user_id,))
-        
-        messages = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT * FROM messages WHERE receiver_id = ? AND is_read = FALSE
+            """, (user_id,))
+
+            messages = [dict(row) for row in cursor.fetchall()]
+        return messages
+
+    @staticmethod
+    def get_all_messages() -> List[dict]:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM messages ORDER BY timestamp DESC")
+            messages = [dict(row) for row in cursor.fetchall()]
         return messages
 
     @staticmethod
-    def mark_as_read(message_id: int):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("UPDATE messages SET is_read = TRUE WHERE id = ?", (message_id,))
-        
-        conn.commit()
-        conn.close()
+    def export_messages(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                        user_id: Optional[int] = None, message_type: Optional[str] = None,
+                        include_file_data: bool = False,
+                        batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[dict]]:
+        """
+        Выгрузка сообщений пачками по batch_size строк.
+        Использует отдельное соединение (не из пула), чтобы долгая выгрузка
+        не занимала соединение, нужное обработчикам запросов.
+        """
+        columns = EXPORT_COLUMNS + (("file_data",) if include_file_data else ())
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since.strftime("%Y-%m-%d %H:%M:%S"))
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(until.strftime("%Y-%m-%d %H:%M:%S"))
+        if user_id is not None:
+            conditions.append("(sender_id = ? OR receiver_id = ?)")
+            params.extend((user_id, user_id))
+        if message_type is not None:
+            conditions.append("message_type = ?")
+            params.append(message_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        conn = open_connection()
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(columns)} FROM messages {where} ORDER BY id", params
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def mark_as_read(message_id: int, reader_id: int) -> bool:
+        """Отметить прочитанным входящее сообщение reader_id; False - такого сообщения у него нет"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                "SELECT sender_id, receiver_id, is_read FROM messages WHERE id = ? AND receiver_id = ?",
+                (message_id, reader_id)
+            )
+            message = cursor.fetchone()
+            if message is None:
+                return False
+            if not message["is_read"]:
+                cursor.execute("UPDATE messages SET is_read = TRUE WHERE id = ?", (message_id,))
+                ConversationModel.on_messages_read(cursor, message["receiver_id"], message["sender_id"], 1)
+
+            conn.commit()
+            return True
+
+    @staticmethod
+    def mark_conversation_read(reader_id: int, contact_id: int, up_to_id: int) -> int:
+        """Отметить прочитанными все входящие от contact_id с id <= up_to_id одним UPDATE"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE messages SET is_read = TRUE
+                WHERE user_low = ? AND user_high = ? AND id <= ?
+                  AND receiver_id = ? AND is_read = FALSE
+            """, (min(reader_id, contact_id), max(reader_id, contact_id), up_to_id, reader_id))
+            updated = cursor.rowcount
+            ConversationModel.on_messages_read(cursor, reader_id, contact_id, updated)
+            conn.commit()
+        return updated
 
     @staticmethod
-    def delete_message(message_id: int):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM messages WHERE id = ?", (message_id,))
-        conn.commit()
-        conn.close()
\ No newline at end of file
+    def delete_message(message_id: int) -> Optional[dict]:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(
+                "SELECT id, sender_id, receiver_id, is_read, client_msg_id FROM messages WHERE id = ?",
+                (message_id,)
+            )
+            message = cursor.fetchone()
+            if message:
+                message = dict(message)
+                cursor.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+                ConversationModel.on_message_deleted(cursor, message)
+            conn.commit()
+        return message
@@ -0,0 +1,170 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from cache import user_cache, directory_cache, idempotency_cache
+from database.attachment_model import AttachmentModel
+from database.conversation_model import ConversationModel
+from database.executor import db_executor
+from database.message_model import MessageModel
+from database.user_model import UserModel
+from database.write_pipeline import message_pipeline
+
+# Асинхронные обёртки над MessageModel и UserModel для обработчиков FastAPI.
+# Сами запросы остаются синхронными и выполняются в потоках db_executor,
+# чтобы не блокировать event loop и WebSocket-соединения.
+
+
+class MessageRepository:
+    @staticmethod
+    async def create_message(sender_id: int, receiver_id: int, content: str,
+                             message_type: str = "text", attachment_id: Optional[str] = None,
+                             client_msg_id: Optional[str] = None) -> dict:
+        """
+        Вставка через конвейер групповой фиксации; возвращает созданную строку.
+        Повтор с тем же client_msg_id возвращает исходную строку с replayed=True.
+        """
+        if client_msg_id:
+            cached = idempotency_cache.get((sender_id, client_msg_id))
+            if cached is not None:
+                return dict(cached, replayed=True)
+        row = await message_pipeline.submit(
+            sender_id, receiver_id, content, message_type, attachment_id, client_msg_id
+        )
+        if client_msg_id:
+            idempotency_cache.set((sender_id, client_msg_id), dict(row, replayed=False))
+        return row
+
+    @staticmethod
+    async def get_message(message_id: int) -> Optional[dict]:
+        return await db_executor.read(MessageModel.get_message, message_id)
+
+    @staticmethod
+    async def get_messages_between_users(user1_id: int, user2_id: int, limit: int = 100,
+                                         before_id: Optional[int] = None,
+                                         after_id: Optional[int] = None) -> List[dict]:
+        return await db_executor.read(
+            MessageModel.get_messages_between_users, user1_id, user2_id, limit, before_id, after_id
+        )
+
+    @staticmethod
+    async def get_messages_since(user_id: int, since_id: int, limit: int = 500,
+                                 contact_id: Optional[int] = None) -> List[dict]:
+        return await db_executor.read(MessageModel.get_messages_since, user_id, since_id, limit, contact_id)
+
+    @staticmethod
+    async def search_messages(user_id: int, text: str, contact_id: Optional[int] = None,
+                              limit: int = 20, offset: int = 0) -> List[dict]:
+        return await db_executor.read(MessageModel.search_messages, user_id, text, contact_id, limit, offset)
+
+    @staticmethod
+    async def get_unread_messages(user_id: int) -> List[dict]:
+        return await db_executor.read(MessageModel.get_unread_messages, user_id)
+
+    @staticmethod
+    async def get_all_messages() -> List[dict]:
+        return await db_executor.read(MessageModel.get_all_messages)
+
+    @staticmethod
+    async def mark_as_read(message_id: int, reader_id: int) -> bool:
+        return await db_executor.write(MessageModel.mark_as_read, message_id, reader_id)
+
+    @staticmethod
+    async def mark_conversation_read(reader_id: int, contact_id: int, up_to_id: int) -> int:
+        return await db_executor.write(MessageModel.mark_conversation_read, reader_id, contact_id, up_to_id)
+
+    @staticmethod
+    async def delete_message(message_id: int) -> Optional[dict]:
+        message = await db_executor.write(MessageModel.delete_message, message_id)
+        # Ключ удалённого сообщения снова свободен, как и в уникальном индексе
+        if message and message["client_msg_id"]:
+            idempotency_cache.invalidate((message["sender_id"], message["client_msg_id"]))
+        return message
+
+
+class UserRepository:
+    @staticmethod
+    async def create_user(username: str, password_hash: str, is_admin: bool = False) -> int:
+        user_id = await db_executor.write(UserModel.create_user, username, password_hash, is_admin)
+        directory_cache.clear()
+        return user_id
+
+    @staticmethod
+    async def count_users() -> int:
+        return await db_executor.read(UserModel.count_users)
+
+    @staticmethod
+    async def get_user_by_username(username: str) -> Optional[dict]:
+        return await db_executor.read(UserModel.get_user_by_username, username)
+
+    @staticmethod
+    async def get_user_by_id(user_id: int) -> Optional[dict]:
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await db_executor.read(UserModel.get_user_by_id, user_id)
+            if user:
+                user_cache.set(user_id, user)
+        return user
+
+    @staticmethod
+    async def update_user_status(user_id: int, is_online: bool, status: str):
+        result = await db_executor.write(UserModel.update_user_status, user_id, is_online, status)
+        user_cache.invalidate(user_id)
+        return result
+
+    @staticmethod
+    async def update_last_seen(user_id: int):
+        return await db_executor.write(UserModel.update_last_seen, user_id)
+
+    @staticmethod
+    async def update_last_seen_many(last_seen: Dict[int, datetime]):
+        return await db_executor.write(UserModel.update_last_seen_many, last_seen)
+
+    @staticmethod
+    async def update_presence_many(states: Dict[int, dict]):
+        result = await db_executor.write(UserModel.update_presence_many, states)
+        for user_id in states:
+            user_cache.invalidate(user_id)
+        return result
+
+    @staticmethod
+    async def reset_presence() -> int:
+        result = await db_executor.write(UserModel.reset_presence)
+        user_cache.clear()
+        directory_cache.clear()
+        return result
+
+    @staticmethod
+    async def get_all_users() -> List[dict]:
+        # Список пользователей меняется только при регистрации, онлайн-статус берётся из presence
+        users = directory_cache.get("all")
+        if users is None:
+            users = await db_executor.read(UserModel.get_all_users)
+            directory_cache.set("all", users)
+        return users
+
+    @staticmethod
+    async def is_admin(user_id: int) -> bool:
+        return await db_executor.read(UserModel.is_admin, user_id)
+
+
+class AttachmentRepository:
+    @staticmethod
+    async def register(attachment_id: str, size: int, mime_type: str, user_id: int) -> dict:
+        return await db_executor.write(AttachmentModel.register, attachment_id, size, mime_type, user_id)
+
+    @staticmethod
+    async def get_attachment(attachment_id: str) -> Optional[dict]:
+        return await db_executor.read(AttachmentModel.get_attachment, attachment_id)
+
+    @staticmethod
+    async def can_access(attachment_id: str, user_id: int) -> bool:
+        return await db_executor.read(AttachmentModel.can_access, attachment_id, user_id)
+
+
+class ConversationRepository:
+    @staticmethod
+    async def get_peer_ids(user_id: int) -> List[int]:
+        return await db_executor.read(ConversationModel.get_peer_ids, user_id)
+
+    @staticmethod
+    async def get_conversations(user_id: int) -> List[dict]:
+        return await db_executor.read(ConversationModel.get_conversations, user_id)
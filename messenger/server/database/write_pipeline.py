@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from database.executor import db_executor
+from database.message_model import MessageModel
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать попутчиков для пачки и максимальный размер пачки
+BATCH_WINDOW = 0.002
+MAX_BATCH_SIZE = 100
+
+
+class MessageWritePipeline:
+    """
+    Групповая фиксация вставок сообщений.
+    Обработчики кладут сообщение в очередь и ждут future; единственная задача-писатель
+    собирает пачку за BATCH_WINDOW секунд и вставляет её одной транзакцией,
+    возвращая каждому вызывающему готовую строку (без повторного чтения из БД).
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH_SIZE):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batches = 0
+        self._messages = 0
+        self._max_batch_seen = 0
+        self._failures = 0
+        self._commit_time = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописать уже принятые сообщения и остановить писателя"""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, sender_id: int, receiver_id: int, content: str,
+                     message_type: str = "text", attachment_id: Optional[str] = None,
+                     client_msg_id: Optional[str] = None) -> dict:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((sender_id, receiver_id, content, message_type, attachment_id, client_msg_id), future))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: list):
+        started = time.perf_counter()
+        try:
+            rows = await db_executor.write(MessageModel.create_messages, [params for params, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                self._failures += 1
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # Ошибка одной вставки не должна отменять остальные: повторяем по одной
+            logger.warning(f"Batch insert of {len(batch)} messages failed ({e}), retrying one by one")
+            for item in batch:
+                await self._write([item])
+            return
+        self._commit_time += time.perf_counter() - started
+        self._batches += 1
+        self._messages += len(rows)
+        self._max_batch_seen = max(self._max_batch_seen, len(rows))
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logger.error(f"Message write pipeline error: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "batches": self._batches,
+            "messages": self._messages,
+            "avg_batch_size": self._messages / self._batches if self._batches else 0.0,
+            "max_batch_size": self._max_batch_seen,
+            "failures": self._failures,
+            "avg_commit_seconds": self._commit_time / self._batches if self._batches else 0.0,
+            "window_seconds": self.window,
+        }
+
+
+message_pipeline = MessageWritePipeline()
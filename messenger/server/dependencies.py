@@ -1,31 +1,69 @@
-from fastapi import HTTPException, Depends
+from typing import Optional
+from fastapi import HTTPException, Depends, WebSocket
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
-from database.user_model import UserModel
+import time
+from database.repositories import UserRepository
+from cache import token_cache, user_cache
+from activity import activity_tracker
+from ratelimit import rate_limiter
 
 security = HTTPBearer()
 SECRET_KEY = "your-secret-key-here"
+# WebSocket передаёт JWT в Sec-WebSocket-Protocol: "messenger.auth.<token>"
+# (в отличие от параметра URL, заголовок не попадает в журнал доступа)
+AUTH_PROTOCOL_PREFIX = "messenger.auth."
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+async def authenticate(token: str) -> dict:
+    """Пользователь по JWT; общий путь для HTTP-запросов и WebSocket"""
+    user_id = token_cache.get(token)
+    user = user_cache.get(user_id) if user_id is not None else None
+
+    if user is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token expired")
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=401, detail="Invalid token")
         username = payload.get("sub")
         if not username:
             raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = UserModel.get_user_by_username(username)
+
+        user = await UserRepository.get_user_by_username(username)
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
-        
-        # Обновляем время последней активности при каждом запросе
-        try:
-            UserModel.update_last_seen(user["id"])
-        except:
-            pass  # Игнорируем ошибки обновления last_seen
-        
-        return user
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+
+        # Токен кэшируется не дольше срока его действия
+        ttl = payload["exp"] - time.time() if "exp" in payload else None
+        token_cache.set(token, user["id"], ttl)
+        user_cache.set(user["id"], user)
+
+    return user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    user = await authenticate(credentials.credentials)
+
+    # Общий лимит запросов пользователя; отдельные маршруты добавляют свои (limit_user)
+    rate_limiter.check("user", user["id"])
+
+    # Время последней активности пишется в БД пакетами (см. activity.py)
+    activity_tracker.touch(user["id"])
+
+    return user
+
+async def get_websocket_user(websocket: WebSocket) -> Optional[dict]:
+    """Пользователь по токену из Sec-WebSocket-Protocol; None - токена нет или он недействителен"""
+    for protocol in websocket.scope.get("subprotocols", []):
+        if protocol.startswith(AUTH_PROTOCOL_PREFIX):
+            try:
+                return await authenticate(protocol[len(AUTH_PROTOCOL_PREFIX):])
+            except HTTPException:
+                return None
+    return None
+
+def limit_user(rule: str):
+    """Зависимость маршрута: отдельная корзина rule на пользователя"""
+    async def dependency(current_user: dict = Depends(get_current_user)):
+        rate_limiter.check(rule, current_user["id"])
+    return dependency
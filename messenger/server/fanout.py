@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Настройки многопроцессного режима (переменные окружения)
+FANOUT_BACKEND = os.environ.get("MESSENGER_FANOUT", "local")
+HUB_SOCKET = os.environ.get("MESSENGER_HUB_SOCKET", "/tmp/messenger-hub.sock")
+HUB_RECONNECT_DELAY = 1
+
+
+class LocalFanout:
+    """Доставка событий в пределах одного процесса (режим по умолчанию)"""
+
+    def __init__(self):
+        self.manager = None
+        self.presence = None
+
+    def bind(self, manager, presence):
+        self.manager = manager
+        self.presence = presence
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def attach(self, user_id: int):
+        """У процесса появилось первое соединение пользователя"""
+
+    def detach(self, user_id: int):
+        """Закрыто последнее соединение пользователя в этом процессе"""
+
+    async def publish(self, event: dict, user_ids: Iterable[int]):
+        self.manager.deliver_local(event, user_ids)
+
+    async def publish_presence(self, user_id: int, is_online: bool):
+        await self.manager.broadcast_status_update(user_id, is_online)
+
+    def publish_invalidation(self, cache: str, keys: Optional[Iterable] = None):
+        """Сбросить кэш в других процессах: ключи keys или весь кэш (keys=None)"""
+
+    def stats(self) -> dict:
+        return {"backend": "local"}
+
+
+class HubFanout(LocalFanout):
+    """
+    Доставка через локальный брокер (fanout_hub.py) по Unix-сокету.
+    Процесс сообщает брокеру, какие пользователи подключены к нему, и получает
+    только события для своих соединений; смены онлайн-статуса получают все процессы.
+    Протокол - JSON по строке на сообщение.
+    """
+
+    def __init__(self, path: str = HUB_SOCKET):
+        super().__init__()
+        self.path = path
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        self._published = 0
+        self._received = 0
+        self._fallbacks = 0
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                logger.error(f"Fan-out hub {self.path} is not available, delivering locally until it is")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(HUB_RECONNECT_DELAY)
+                continue
+            self._writer = writer
+            # После (пере)подключения сообщаем брокеру о своих пользователях
+            for user_id in list(self.manager.active_connections):
+                self._send({"op": "attach", "user_id": user_id})
+            self._connected.set()
+            logger.info(f"Connected to fan-out hub {self.path}")
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._received += 1
+                    await self._handle(json.loads(line))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Fan-out hub connection error: {e}")
+            finally:
+                self._connected.clear()
+                self._writer = None
+                writer.close()
+            logger.warning("Disconnected from fan-out hub, reconnecting")
+            await asyncio.sleep(HUB_RECONNECT_DELAY)
+
+    def _send(self, message: dict) -> bool:
+        if self._writer is None:
+            return False
+        self._writer.write(json.dumps(message).encode() + b"\n")
+        self._published += 1
+        return True
+
+    async def _handle(self, message: dict):
+        op = message.get("op")
+        if op == "deliver":
+            self.manager.deliver_local(message["event"], message["user_ids"])
+        elif op == "presence":
+            user_id = message["user_id"]
+            last_seen = message.get("last_seen")
+            self.presence.apply_remote(
+                user_id, message["is_online"], message["status"],
+                datetime.fromisoformat(last_seen) if last_seen else None
+            )
+            if not message["is_online"] and self.manager.active_connections.get(user_id):
+                # У пользователя остались соединения в этом процессе
+                self.presence.heartbeat(user_id)
+            await self.manager.broadcast_status_update(user_id, message["is_online"])
+        elif op == "invalidate":
+            from cache import directory_cache, user_cache
+            cache = {"directory": directory_cache, "user": user_cache}.get(message.get("cache"))
+            if cache is None:
+                return
+            if message.get("keys") is None:
+                cache.clear()
+            else:
+                for key in message["keys"]:
+                    cache.invalidate(key)
+
+    def attach(self, user_id: int):
+        self._send({"op": "attach", "user_id": user_id})
+
+    def detach(self, user_id: int):
+        self._send({"op": "detach", "user_id": user_id})
+
+    async def publish(self, event: dict, user_ids: Iterable[int]):
+        user_ids = list(user_ids)
+        if not self._send({"op": "deliver", "user_ids": user_ids, "event": event}):
+            self._fallbacks += 1
+            self.manager.deliver_local(event, user_ids)
+
+    async def publish_presence(self, user_id: int, is_online: bool):
+        state = self.presence.state(user_id)
+        self._send({
+            "op": "presence",
+            "user_id": user_id,
+            "is_online": is_online,
+            "status": state["status"] if state else ("online" if is_online else "offline"),
+            "last_seen": state["last_seen"].isoformat() if state and state["last_seen"] else None,
+        })
+        await self.manager.broadcast_status_update(user_id, is_online)
+
+    def publish_invalidation(self, cache: str, keys: Optional[Iterable] = None):
+        self._send({"op": "invalidate", "cache": cache, "keys": list(keys) if keys is not None else None})
+
+    def stats(self) -> dict:
+        return {
+            "backend": "hub",
+            "socket": self.path,
+            "connected": self._connected.is_set(),
+            "published": self._published,
+            "received": self._received,
+            "local_fallbacks": self._fallbacks,
+        }
+
+
+def create_fanout(backend: str = FANOUT_BACKEND):
+    if backend == "hub":
+        return HubFanout()
+    if backend != "local":
+        raise ValueError(f"Unknown fan-out backend: {backend!r}")
+    return LocalFanout()
+
+
+fanout = create_fanout()
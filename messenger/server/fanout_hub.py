@@ -0,0 +1,109 @@
+"""
+Локальный брокер событий для многопроцессного режима сервера.
+
+Рабочие процессы подключаются по Unix-сокету и сообщают, какие пользователи
+подключены к ним (attach/detach). События deliver пересылаются только процессам,
+держащим соединения получателей; presence и invalidate - всем остальным процессам.
+
+Запуск:
+    python fanout_hub.py --socket /tmp/messenger-hub.sock
+(main.py запускает брокер сам при MESSENGER_FANOUT=hub и MESSENGER_WORKERS > 1)
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+from fanout import HUB_SOCKET
+
+logger = logging.getLogger("fanout_hub")
+
+
+class FanoutHub:
+    def __init__(self):
+        self.workers = set()
+        self.holders = {}  # user_id -> {writer: число attach}
+
+    def _send(self, writer: asyncio.StreamWriter, message: dict):
+        writer.write(json.dumps(message).encode() + b"\n")
+
+    def _forget(self, writer):
+        self.workers.discard(writer)
+        for user_id in list(self.holders):
+            self.holders[user_id].pop(writer, None)
+            if not self.holders[user_id]:
+                del self.holders[user_id]
+
+    def _route(self, writer, message: dict):
+        op = message.get("op")
+        if op == "attach":
+            holders = self.holders.setdefault(message["user_id"], {})
+            holders[writer] = holders.get(writer, 0) + 1
+        elif op == "detach":
+            holders = self.holders.get(message["user_id"], {})
+            if writer in holders:
+                holders[writer] -= 1
+                if holders[writer] <= 0:
+                    del holders[writer]
+            if not holders:
+                self.holders.pop(message["user_id"], None)
+        elif op == "deliver":
+            targets = {}
+            for user_id in message["user_ids"]:
+                for holder in self.holders.get(user_id, ()):
+                    targets.setdefault(holder, []).append(user_id)
+            for holder, user_ids in targets.items():
+                self._send(holder, {"op": "deliver", "user_ids": user_ids, "event": message["event"]})
+        elif op in ("presence", "invalidate"):
+            for worker in self.workers:
+                if worker is not writer:
+                    self._send(worker, message)
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.workers.add(writer)
+        logger.info(f"Worker connected ({len(self.workers)} total)")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    self._route(writer, json.loads(line))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Bad message from worker: {e}")
+        finally:
+            self._forget(writer)
+            writer.close()
+            logger.info(f"Worker disconnected ({len(self.workers)} total)")
+
+
+async def serve(path: str):
+    if os.path.exists(path):
+        os.unlink(path)
+    hub = FanoutHub()
+    server = await asyncio.start_unix_server(hub.handle_worker, path=path)
+    logger.info(f"Fan-out hub listening on {path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Messenger fan-out hub")
+    parser.add_argument("--socket", default=HUB_SOCKET, help="Unix socket path")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
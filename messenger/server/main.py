@@ -1,48 +1,58 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from database.db import init_db
-from routers import auth, messages, users, admin
+from fastapi.responses import Response
+from database.db import init_db, pool
+from routers import auth, messages, users, admin, attachments, conversations
 from fastapi import WebSocket, WebSocketDisconnect
 from websocket_manager import manager
-import asyncio
-from database.user_model import UserModel
-
-async def check_inactive_users_periodically():
-    """Периодическая проверка неактивных пользователей"""
-    while True:
-        try:
-            inactive_users = UserModel.check_inactive_users(timeout_minutes=1)
-            if inactive_users:
-                print(f"📴 Marked users as offline due to inactivity: {inactive_users}")
-        except Exception as e:
-            print(f"Error checking inactive users: {e}")
-        
-        await asyncio.sleep(60)  # Проверка каждую минуту
+from presence import presence
+from fanout import fanout, FANOUT_BACKEND, HUB_SOCKET
+from ws_protocol import negotiate
+from database.executor import db_executor
+from database.write_pipeline import message_pipeline
+from database.repositories import MessageRepository
+from schemas.message import MessageResponse
+from thumbnails import thumbnail_service
+from dependencies import get_websocket_user
+from activity import activity_tracker
+from passwords import password_hasher
+from maintenance import maintenance_service
+from metrics import MetricsMiddleware, registry, CONTENT_TYPE
+from ratelimit import rate_limiter
+import os
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Инициализация базы данных при запуске
     init_db()
+    db_executor.start()
+    message_pipeline.start()
+    thumbnail_service.start()
+    activity_tracker.start()
+    password_hasher.start()
     
-    # Запускаем фоновую задачу для проверки неактивных пользователей
-    task = asyncio.create_task(check_inactive_users_periodically())
+    # Онлайн-статусы по сигналам WebSocket (вместо периодической проверки в БД)
+    await presence.start()
+    # Доставка событий между рабочими процессами (MESSENGER_FANOUT=hub)
+    await fanout.start()
+    # Архивация старых сообщений, очистка вложений и VACUUM раз в сутки
+    maintenance_service.start()
     
     yield
     
-    # Останавливаем задачу при остановке приложения
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Инициализация базы данных при запуске
-    init_db()
-    yield
-    # Опционально: код для закрытия соединений при остановке
+    await maintenance_service.stop()
+    await fanout.stop()
+    await message_pipeline.stop()
+    # Записываем накопленные смены статусов и отметки активности
+    await presence.stop()
+    await activity_tracker.stop()
+    
+    # Дожидаемся выполнения запросов и закрываем соединения пула
+    thumbnail_service.shutdown()
+    password_hasher.shutdown()
+    db_executor.shutdown()
+    pool.close_all()
 
 app = FastAPI(
     title="Local Messenger API",
@@ -57,35 +67,140 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Задержки и коды ответов по маршрутам для /metrics
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(messages.router, prefix="/messages", tags=["messages"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(admin.router, prefix="/admin", tags=["admin"])
+app.include_router(attachments.router, prefix="/attachments", tags=["attachments"])
+app.include_router(conversations.router, prefix="/conversations", tags=["conversations"])
+
+# Показатели сервисов, вычисляемые при каждом чтении /metrics
+registry.gauge("messenger_ws_connections", "Open WebSocket connections",
+               lambda: manager.stats()["connections"])
+registry.gauge("messenger_ws_connected_users", "Users with at least one WebSocket connection",
+               lambda: manager.stats()["connected_users"])
+registry.gauge("messenger_ws_queued_events", "Events waiting in per-connection send queues",
+               lambda: manager.stats()["queued_events"])
+registry.gauge("messenger_ws_dropped_events", "Events dropped because a send queue overflowed",
+               lambda: manager.stats()["dropped_events"])
+registry.gauge("messenger_online_users", "Users considered online by the presence service",
+               lambda: presence.stats()["online"])
+registry.gauge("messenger_db_pool_connections", "SQLite pool connections by state",
+               lambda: {"idle": pool.stats()["idle"], "in_use": pool.stats()["in_use"]}, ("state",))
+registry.gauge("messenger_db_executor_queue", "Queries waiting for a database thread",
+               lambda: {"read": db_executor.stats()["read_queue"], "write": db_executor.stats()["write_queue"]},
+               ("pool",))
+registry.gauge("messenger_message_pipeline_queue", "Messages waiting for the group-commit writer",
+               lambda: message_pipeline.stats()["queue_depth"])
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+SYNC_BATCH_SIZE = 500
+
+async def handle_client_frame(websocket: WebSocket, user_id: int, message: dict):
+    """Обработка JSON-сообщений клиента"""
+    message_type = message.get("type") if isinstance(message, dict) else None
+    
+    if message_type == "sync":
+        # Клиент после (пере)подключения запрашивает всё, что пропустил;
+        # contact_id ограничивает выборку перепиской открытого чата
+        try:
+            since_id = int(message.get("since_id") or 0)
+            contact_id = int(message["contact_id"]) if message.get("contact_id") is not None else None
+        except (TypeError, ValueError):
+            return
+        missed = await MessageRepository.get_messages_since(user_id, since_id, SYNC_BATCH_SIZE + 1, contact_id)
+        has_more = len(missed) > SYNC_BATCH_SIZE
+        missed = missed[:SYNC_BATCH_SIZE]
+        manager.send_to_connection(websocket, {
+            "type": "sync",
+            "messages": [MessageResponse(**msg).model_dump(mode="json") for msg in missed],
+            "contact_id": contact_id,
+            "last_id": missed[-1]["id"] if missed else since_id,
+            "has_more": has_more
+        })
+    
+    elif message_type == "read":
+        # Отметка прочитанного: {"type": "read", "contact_id": ..., "up_to_id": ...};
+        # читатель - пользователь из проверенного токена, а не id из пути
+        reader_id = getattr(websocket.state, "user_id", None)
+        if reader_id is None or reader_id != user_id:
+            return
+        try:
+            contact_id = int(message["contact_id"])
+            up_to_id = int(message["up_to_id"])
+        except (KeyError, TypeError, ValueError):
+            return
+        await messages.apply_read_receipt(reader_id, contact_id, up_to_id)
+    
+    elif message_type in ("subscribe", "unsubscribe"):
+        # Статусы каких пользователей нужны клиенту: {"type": "subscribe", "user_ids": [...]}
+        try:
+            user_ids = {int(subject_id) for subject_id in message.get("user_ids") or []}
+        except (TypeError, ValueError):
+            return
+        if message_type == "subscribe":
+            manager.subscribe(websocket, user_id, user_ids)
+        else:
+            manager.unsubscribe(websocket, user_id, user_ids)
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    await manager.connect(websocket, user_id)
+    # JWT проверяется до accept: без него или с чужим токеном соединение закрывается с 1008
+    user = await get_websocket_user(websocket)
+    if not user or user["id"] != user_id:
+        await websocket.close(code=1008)
+        return
+    websocket.state.user_id = user["id"]
+    # Клиент в цикле переподключений: 1013 - повторить позже
+    if rate_limiter.acquire("ws.connect", user_id):
+        await websocket.close(code=1013)
+        return
+    
+    # Формат кадров выбирается по Sec-WebSocket-Protocol; без него - JSON с текстовым ping
+    codec = negotiate(websocket.scope.get("subprotocols", []))
+    await manager.connect(websocket, user_id, codec)
+    throttled = False
     try:
         while True:
             try:
                 # Ожидаем сообщения
-                data = await websocket.receive_text()
+                frame = await websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    break
+                data = frame.get("bytes") if frame.get("bytes") is not None else frame.get("text")
+                presence.heartbeat(user_id)
                 
-                # Обрабатываем ping/pong
+                # Текстовые ping/pong старых клиентов; новые используют ping-кадры WebSocket
                 if data == 'ping':
-                    await websocket.send_text('pong')
+                    manager.send_to_connection(websocket, 'pong')
                 elif data == 'pong':
                     continue
                 else:
-                    # Можно добавить обработку других сообщений
+                    # Сверх лимита кадры отбрасываются; клиент получает одно уведомление на серию
+                    retry_after = rate_limiter.acquire("ws.frame", user_id)
+                    if retry_after:
+                        if not throttled:
+                            throttled = True
+                            manager.send_to_connection(websocket, {
+                                "type": "error",
+                                "code": "rate_limited",
+                                "retry_after": round(retry_after, 3)
+                            })
+                        continue
+                    throttled = False
                     try:
-                        message = json.loads(data)
-                        # Здесь можно добавить логику обработки сообщений
-                        pass
-                    except json.JSONDecodeError:
-                        pass
+                        message = codec.decode(data)
+                    except Exception:
+                        continue
+                    await handle_client_frame(websocket, user_id, message)
                         
             except WebSocketDisconnect:
                 break
@@ -102,6 +217,31 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
         except:
             pass
         
+# Адрес и число рабочих процессов; при WORKERS > 1 нужен MESSENGER_FANOUT=hub
+# Ping-кадры WebSocket и сжатие permessage-deflate
+WS_OPTIONS = {"ws_ping_interval": 20.0, "ws_ping_timeout": 20.0, "ws_per_message_deflate": True}
+HOST = os.environ.get("MESSENGER_HOST", "192.168.0.51")
+PORT = int(os.environ.get("MESSENGER_PORT", "8000"))
+WORKERS = int(os.environ.get("MESSENGER_WORKERS", "1"))
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="192.168.0.51", port=8000)
\ No newline at end of file
+    if WORKERS > 1:
+        import subprocess
+        import sys
+        from database.user_model import UserModel
+        if FANOUT_BACKEND != "hub":
+            sys.exit("MESSENGER_WORKERS > 1 requires MESSENGER_FANOUT=hub")
+        # Статусы прошлого запуска сбрасываются здесь один раз, а не при старте каждого рабочего процесса
+        init_db()
+        UserModel.reset_presence()
+        pool.close_all()
+        os.environ["MESSENGER_PRESENCE_RESET"] = "0"
+        # Брокер событий запускается до рабочих процессов и останавливается вместе с сервером
+        hub = subprocess.Popen([sys.executable, "fanout_hub.py", "--socket", HUB_SOCKET])
+        try:
+            uvicorn.run("main:app", host=HOST, port=PORT, workers=WORKERS, **WS_OPTIONS)
+        finally:
+            hub.terminate()
+    else:
+        uvicorn.run(app, host=HOST, port=PORT, **WS_OPTIONS)
\ No newline at end of file
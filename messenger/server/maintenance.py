@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from attachment_store import attachment_store
+from database.conversation_model import ConversationModel
+from database.attachment_model import AttachmentModel
+from database.executor import db_executor
+from database.maintenance_model import MaintenanceModel
+from thumbnails import thumbnail_service
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами не нужна (один рабочий процесс)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Сообщения старше RETENTION_DAYS переносятся в помесячные архивы ARCHIVE_DIR/messages-YYYY-MM.db;
+# MESSENGER_RETENTION_DAYS=0 отключает архивацию (очистка и VACUUM выполняются всё равно)
+RETENTION_DAYS = int(os.environ.get("MESSENGER_RETENTION_DAYS", "365"))
+ARCHIVE_DIR = Path(os.environ.get("MESSENGER_ARCHIVE_DIR", "archive"))
+LOCK_PATH = Path("maintenance.lock")
+
+MAINTENANCE_INTERVAL = 24 * 60 * 60
+START_DELAY = 5 * 60
+ARCHIVE_BATCH_SIZE = 500
+VACUUM_STEP_PAGES = 1000
+# Вложения моложе этого срока не удаляются: клиент мог загрузить файл и ещё не отправить сообщение
+ATTACHMENT_GRACE = timedelta(days=1)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _month_bounds(timestamp: str):
+    """Начало месяца, начало следующего месяца и суффикс архива для времени сообщения"""
+    start = datetime.strptime(timestamp[:7], "%Y-%m")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.strftime(TIMESTAMP_FORMAT), end.strftime(TIMESTAMP_FORMAT), start.strftime("%Y-%m")
+
+
+class MaintenanceService:
+    """
+    Периодическое обслуживание базы: архивация старых сообщений, удаление
+    осиротевших вложений, incremental VACUUM, ANALYZE и сверка счётчиков непрочитанных.
+    Все шаги идут небольшими порциями через поток писателя, поэтому
+    обычные запросы продолжают выполняться между ними.
+    """
+
+    def __init__(self, retention_days: int = RETENTION_DAYS, archive_dir=ARCHIVE_DIR,
+                 interval: float = MAINTENANCE_INTERVAL, start_delay: float = START_DELAY):
+        self.retention_days = retention_days
+        self.archive_dir = Path(archive_dir)
+        self.interval = interval
+        self.start_delay = start_delay
+        self._task: Optional[asyncio.Task] = None
+        self._run_lock = asyncio.Lock()
+        self._stats_lock = threading.Lock()
+        self._runs = 0
+        self._failures = 0
+        self._skipped = 0
+        self._last_report: Optional[dict] = None
+
+    def archive_paths(self):
+        return sorted(self.archive_dir.glob("messages-*.db"))
+
+    def _acquire_process_lock(self):
+        """Блокировка файла: при нескольких рабочих процессах задание выполняет только один"""
+        lock_file = open(LOCK_PATH, "a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    async def _archive(self, report: dict):
+        if self.retention_days <= 0:
+            return
+        cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).strftime(TIMESTAMP_FORMAT)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        while True:
+            oldest = await db_executor.read(MaintenanceModel.oldest_message_before, cutoff)
+            if oldest is None:
+                break
+            since, month_end, month = _month_bounds(oldest)
+            until = min(month_end, cutoff)
+            archive_path = self.archive_dir / f"messages-{month}.db"
+            moved = await db_executor.write(
+                MaintenanceModel.archive_batch, archive_path, since, until, ARCHIVE_BATCH_SIZE
+            )
+            if not moved:
+                break
+            report["messages_archived"] += moved
+            report["archives"][month] = report["archives"].get(month, 0) + moved
+
+    async def _prune_attachments(self, report: dict):
+        created_before = (datetime.utcnow() - ATTACHMENT_GRACE).strftime(TIMESTAMP_FORMAT)
+        pruned = await db_executor.write(
+            MaintenanceModel.prune_orphan_attachments, created_before, self.archive_paths()
+        )
+        freed = 0
+        for attachment in pruned:
+            # Тот же файл могли загрузить заново после удаления записи - тогда он снова нужен
+            if await db_executor.read(AttachmentModel.get_attachment, attachment["id"]):
+                continue
+            freed += attachment_store.delete(attachment["id"])
+            freed += thumbnail_service.discard(attachment["id"])
+        freed += attachment_store.prune_tmp(ATTACHMENT_GRACE.total_seconds())
+        report["attachments_pruned"] = len(pruned)
+        report["attachment_bytes_freed"] = freed
+
+    async def _vacuum(self, report: dict, size_before: dict):
+        if size_before["auto_vacuum"] != 2:
+            # Без auto_vacuum=INCREMENTAL свободные страницы остаются в файле до полного VACUUM
+            report["vacuum"] = "skipped: run 'python manage.py maintenance --full-vacuum' once"
+            return
+        remaining = None
+        while remaining != 0:
+            previous = remaining
+            remaining = await db_executor.write(MaintenanceModel.incremental_vacuum, VACUUM_STEP_PAGES)
+            if remaining == previous:
+                break
+        report["vacuum"] = "incremental"
+
+    async def run_once(self) -> Optional[dict]:
+        """Один проход обслуживания; None, если задание уже выполняет другой процесс"""
+        async with self._run_lock:
+            lock_file = self._acquire_process_lock()
+            if lock_file is None:
+                with self._stats_lock:
+                    self._skipped += 1
+                return None
+            started = time.monotonic()
+            report = {
+                "started_at": datetime.now().isoformat(),
+                "retention_days": self.retention_days,
+                "messages_archived": 0,
+                "archives": {},
+                "attachments_pruned": 0,
+                "attachment_bytes_freed": 0,
+            }
+            try:
+                size_before = await db_executor.read(MaintenanceModel.database_size)
+                await self._archive(report)
+                await self._prune_attachments(report)
+                await self._vacuum(report, size_before)
+                await db_executor.write(MaintenanceModel.analyze)
+                report["unread_counters_fixed"] = await db_executor.write(ConversationModel.repair_unread_counts)
+                size_after = await db_executor.read(MaintenanceModel.database_size)
+            except Exception as e:
+                logger.error(f"Maintenance failed: {e}")
+                with self._stats_lock:
+                    self._failures += 1
+                raise
+            finally:
+                lock_file.close()
+
+            report["db_bytes_before"] = size_before["bytes"]
+            report["db_bytes_after"] = size_after["bytes"]
+            report["db_bytes_reclaimed"] = size_before["bytes"] - size_after["bytes"]
+            report["freelist_pages"] = size_after["freelist_count"]
+            report["duration_seconds"] = round(time.monotonic() - started, 3)
+            with self._stats_lock:
+                self._runs += 1
+                self._last_report = report
+            logger.info(
+                f"Maintenance: archived {report['messages_archived']} messages, "
+                f"pruned {report['attachments_pruned']} attachments, "
+                f"reclaimed {report['db_bytes_reclaimed'] + report['attachment_bytes_freed']} bytes"
+            )
+            return report
+
+    async def _run(self):
+        await asyncio.sleep(self.start_delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                pass
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "retention_days": self.retention_days,
+                "interval_seconds": self.interval,
+                "runs": self._runs,
+                "failures": self._failures,
+                "skipped": self._skipped,
+                "last_report": self._last_report,
+            }
+
+
+maintenance_service = MaintenanceService()
@@ -0,0 +1,64 @@
+"""
+Служебные команды сервера.
+
+Запуск из каталога server:
+    python manage.py rebuild-search-index
+    python manage.py maintenance [--full-vacuum]
+"""
+import argparse
+import asyncio
+import json
+import sys
+from database.db import init_db, rebuild_search_index
+
+
+def cmd_rebuild_search_index(args):
+    """Перестроить полнотекстовый индекс заново (миграция заполняет его сама)"""
+    count = rebuild_search_index()
+    print(f"🔎 Search index rebuilt for {count} messages")
+
+
+def cmd_maintenance(args):
+    """Один проход обслуживания (архивация, очистка вложений, VACUUM, ANALYZE)"""
+    from database.executor import db_executor
+    from database.maintenance_model import MaintenanceModel
+    from maintenance import maintenance_service
+
+    if args.full_vacuum:
+        # Разовый перевод существующей базы в auto_vacuum=INCREMENTAL; сервер должен быть остановлен
+        MaintenanceModel.full_vacuum()
+        print("🧹 Full VACUUM done, auto_vacuum is now INCREMENTAL")
+
+    async def run():
+        try:
+            return await maintenance_service.run_once()
+        finally:
+            db_executor.shutdown()
+
+    report = asyncio.run(run())
+    if report is None:
+        print("Maintenance is already running in another process")
+        return
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Messenger server management")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = subparsers.add_parser("rebuild-search-index", help="rebuild the full-text search index")
+    rebuild.set_defaults(func=cmd_rebuild_search_index)
+
+    maintenance = subparsers.add_parser("maintenance", help="archive old messages, prune attachments, vacuum")
+    maintenance.add_argument("--full-vacuum", action="store_true",
+                             help="rewrite the database once to enable incremental auto_vacuum")
+    maintenance.set_defaults(func=cmd_maintenance)
+
+    args = parser.parse_args(argv)
+    init_db()
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
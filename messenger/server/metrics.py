@@ -0,0 +1,247 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Tuple
+
+# Метрики в текстовом формате Prometheus (GET /metrics).
+# Значения хранятся в памяти процесса: при MESSENGER_WORKERS > 1 каждый
+# рабочий процесс отдаёт свои счётчики (messenger_worker_info показывает, какой именно).
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами; наблюдение - один bisect под блокировкой"""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = HTTP_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label_values -> [счётчики по корзинам (последняя - +Inf), сумма]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """Значение вычисляется при чтении /metrics: число или словарь {значения меток: число}"""
+
+    def __init__(self, name: str, documentation: str, callback: Callable, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labels = labels
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        value = self.callback()
+        if isinstance(value, dict):
+            for label_values, sample in value.items():
+                if not isinstance(label_values, tuple):
+                    label_values = (label_values,)
+                yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(sample)}"
+        else:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = HTTP_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name: str, documentation: str, callback: Callable, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, callback, labels))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(list(metric.render()))
+            except Exception:
+                # Ошибка в одном gauge не должна ломать весь ответ
+                continue
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "messenger_http_requests_total", "HTTP requests by route and status code",
+    ("method", "route", "status")
+)
+http_latency = registry.histogram(
+    "messenger_http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route")
+)
+db_query_latency = registry.histogram(
+    "messenger_db_query_duration_seconds", "Database model call latency",
+    ("model", "query"), QUERY_BUCKETS
+)
+db_query_errors = registry.counter(
+    "messenger_db_query_errors_total", "Database model calls that raised",
+    ("model", "query")
+)
+registry.gauge("messenger_worker_info", "Worker process serving this scrape",
+               lambda: {(os.getpid(),): 1}, ("pid",))
+_http_in_progress = 0
+registry.gauge("messenger_http_requests_in_progress", "HTTP requests being handled", lambda: _http_in_progress)
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: задержка и код ответа по шаблону маршрута (/messages/{message_id}),
+    а не по фактическому пути, чтобы число рядов не росло с числом id.
+    Время считается до отправки последнего фрагмента тела, включая потоковые ответы.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global _http_in_progress
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        _http_in_progress += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _http_in_progress -= 1
+            route_path = _route_template(scope)
+            method = scope["method"]
+            http_latency.observe(time.perf_counter() - started, method, route_path)
+            http_requests.inc(method, route_path, status)
+
+
+def _route_template(scope) -> str:
+    """Шаблон пути сработавшего маршрута с префиксом роутера или "unmatched" (404)"""
+    # Новые версии FastAPI не копируют маршруты include_router и хранят полный путь отдельно
+    context = (scope.get("fastapi") or {}).get("effective_route_context")
+    path = getattr(context, "path", None) or getattr(scope.get("route"), "path", None)
+    return path or "unmatched"
+
+
+def timed_queries(cls):
+    """Декоратор класса модели: время каждого статического метода в messenger_db_query_duration_seconds"""
+    model = cls.__name__
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith("_") or not isinstance(attribute, staticmethod):
+            continue
+        func = attribute.__func__
+        # Генераторы (потоковая выгрузка) работают дольше вызова - не измеряем
+        if inspect.isgeneratorfunction(func):
+            continue
+        setattr(cls, name, staticmethod(_timed(func, model, name)))
+    return cls
+
+
+def _timed(func, model: str, query: str):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            db_query_errors.inc(model, query)
+            raise
+        finally:
+            db_query_latency.observe(time.perf_counter() - started, model, query)
+    return wrapper
+
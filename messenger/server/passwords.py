@@ -0,0 +1,110 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt освобождает GIL, поэтому потоки пула загружают несколько ядер
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+# Сколько запросов может ждать свободного потока; сверх этого - отказ (503)
+HASH_QUEUE_SIZE = 64
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь хэширования паролей переполнена"""
+
+
+class PasswordHasher:
+    """Проверка и хэширование паролей bcrypt в отдельном пуле потоков с очередью допуска"""
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_size: int = HASH_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._hash_time = 0.0
+        self._max_hash_time = 0.0
+        self._wait_time = 0.0
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            self._semaphore = asyncio.Semaphore(self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._semaphore = None
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._hash_time += elapsed
+                self._max_hash_time = max(self._max_hash_time, elapsed)
+
+    async def _run(self, func, *args):
+        self.start()
+        with self._lock:
+            if self._waiting + self._in_flight >= self.workers + self.queue_size:
+                self._rejected += 1
+                raise PasswordHasherBusy()
+            self._waiting += 1
+
+        queued_at = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._in_flight += 1
+            self._wait_time += time.perf_counter() - queued_at
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(self._timed, func, *args))
+        finally:
+            self._semaphore.release()
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self._completed
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self._waiting,
+                "in_flight": self._in_flight,
+                "completed": completed,
+                "rejected": self._rejected,
+                "avg_hash_seconds": self._hash_time / completed if completed else 0.0,
+                "max_hash_seconds": self._max_hash_time,
+                "avg_wait_seconds": self._wait_time / completed if completed else 0.0,
+            }
+
+
+password_hasher = PasswordHasher()
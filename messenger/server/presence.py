@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database.repositories import UserRepository
+from fanout import fanout
+
+logger = logging.getLogger(__name__)
+
+# Без открытого WebSocket-соединения онлайн-статус (например, после входа) истекает через минуту
+PRESENCE_TIMEOUT = 60
+TICK_INTERVAL = 1
+FLUSH_INTERVAL = 5
+# При MESSENGER_WORKERS > 1 статусы прошлого запуска сбрасывает main.py один раз до запуска
+# рабочих процессов: перезапуск одного из них не должен гасить пользователей остальных
+RESET_ON_START = os.environ.get("MESSENGER_PRESENCE_RESET", "1") != "0"
+
+
+class PresenceService:
+    """
+    Онлайн-статус пользователей в памяти по сигналам живых WebSocket-соединений.
+    Сроки истечения хранятся в куче (по одной действующей записи на пользователя,
+    записи прежних поколений отбрасываются), в SQLite пакетами записываются
+    только смены состояния.
+    """
+
+    def __init__(self, timeout: float = PRESENCE_TIMEOUT, flush_interval: float = FLUSH_INTERVAL):
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self._state: Dict[int, dict] = {}
+        self._deadlines: Dict[int, float] = {}
+        self._generations: Dict[int, int] = {}  # user_id -> поколение действующей записи в куче
+        self._generation = itertools.count()
+        self._heap = []  # (срок, поколение, user_id)
+        self._dirty: Dict[int, dict] = {}
+        self._listeners = []
+        self._liveness_checks = []
+        self._task: Optional[asyncio.Task] = None
+        self._transitions = 0
+        self._expired = 0
+        self._flushes = 0
+        self._flushed_rows = 0
+
+    def add_listener(self, callback):
+        """callback(user_id, is_online) - корутина, вызывается при смене состояния"""
+        self._listeners.append(callback)
+
+    def add_liveness_check(self, check):
+        """check(user_id) -> bool: у пользователя есть открытое соединение"""
+        self._liveness_checks.append(check)
+
+    def is_online(self, user_id: int) -> bool:
+        state = self._state.get(user_id)
+        return bool(state and state["is_online"])
+
+    def state(self, user_id: int) -> Optional[dict]:
+        return self._state.get(user_id)
+
+    def apply_remote(self, user_id: int, is_online: bool, status: str, last_seen: Optional[datetime]):
+        """Смена состояния, случившаяся в другом процессе (запись в БД делает он)"""
+        self._state[user_id] = {"is_online": is_online, "status": status, "last_seen": last_seen}
+        if not is_online:
+            self._forget_deadline(user_id)
+
+    def online_users(self) -> List[int]:
+        return [user_id for user_id, state in self._state.items() if state["is_online"]]
+
+    def heartbeat(self, user_id: int):
+        """Признак жизни соединения: продлевает онлайн-статус"""
+        deadline = time.monotonic() + self.timeout
+        if user_id not in self._generations:
+            generation = next(self._generation)
+            self._generations[user_id] = generation
+            heapq.heappush(self._heap, (deadline, generation, user_id))
+        self._deadlines[user_id] = deadline
+        if not self.is_online(user_id):
+            self._transition(user_id, True, "online")
+
+    def set_status(self, user_id: int, is_online: bool, status: Optional[str] = None):
+        """Явная смена статуса (вход, выход, POST /auth/status)"""
+        status = status or ("online" if is_online else "offline")
+        if is_online:
+            self.heartbeat(user_id)
+            if self._state[user_id]["status"] != status:
+                self._transition(user_id, True, status)
+        else:
+            self._forget_deadline(user_id)
+            if self.is_online(user_id) or user_id not in self._state:
+                self._transition(user_id, False, status)
+
+    def _forget_deadline(self, user_id: int):
+        """Запись в куче остаётся, но её поколение больше не действует и expire её отбросит"""
+        self._deadlines.pop(user_id, None)
+        self._generations.pop(user_id, None)
+
+    def disconnect(self, user_id: int):
+        """Закрыто последнее соединение пользователя"""
+        self.set_status(user_id, False)
+
+    def _transition(self, user_id: int, is_online: bool, status: str):
+        # Как и раньше в update_user_status: last_seen пуст, пока пользователь онлайн
+        last_seen = None if is_online else datetime.now()
+        state = {"is_online": is_online, "status": status, "last_seen": last_seen}
+        self._state[user_id] = state
+        self._dirty[user_id] = state
+        self._transitions += 1
+        for callback in self._listeners:
+            asyncio.create_task(callback(user_id, is_online))
+
+    def expire(self) -> List[int]:
+        """Перевести в оффлайн пользователей, от которых давно не было сигналов"""
+        now = time.monotonic()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, generation, user_id = heapq.heappop(self._heap)
+            if self._generations.get(user_id) != generation:
+                continue  # Пользователь вышел после постановки в кучу
+            deadline = self._deadlines[user_id]
+            if deadline > now:
+                heapq.heappush(self._heap, (deadline, generation, user_id))  # Срок продлён после постановки в кучу
+                continue
+            if any(check(user_id) for check in self._liveness_checks):
+                # Соединение открыто: его живость проверяют ping-кадры WebSocket,
+                # мёртвое соединение закроет сервер и вызовет disconnect
+                deadline = now + self.timeout
+                self._deadlines[user_id] = deadline
+                heapq.heappush(self._heap, (deadline, generation, user_id))
+                continue
+            self._forget_deadline(user_id)
+            if self.is_online(user_id):
+                self._transition(user_id, False, "offline")
+                expired.append(user_id)
+        self._expired += len(expired)
+        return expired
+
+    async def flush(self) -> int:
+        """Записать накопленные смены состояния одной транзакцией"""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await UserRepository.update_presence_many(dirty)
+        except Exception as e:
+            logger.error(f"Error flushing presence: {e}")
+            for user_id, state in dirty.items():
+                self._dirty.setdefault(user_id, state)
+            return 0
+        # Строки users в кэшах других процессов устарели
+        fanout.publish_invalidation("user", dirty)
+        self._flushes += 1
+        self._flushed_rows += len(dirty)
+        return len(dirty)
+
+    def apply(self, user: dict) -> dict:
+        """Подставить в строку пользователя актуальный статус из памяти"""
+        state = self._state.get(user["id"])
+        if state is None:
+            # После запуска сервера пользователь не подключался
+            return {**user, "is_online": False, "status": "offline"}
+        return {
+            **user,
+            "is_online": state["is_online"],
+            "status": state["status"],
+            "last_seen": state["last_seen"] or (None if state["is_online"] else user.get("last_seen")),
+        }
+
+    async def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            await asyncio.sleep(TICK_INTERVAL)
+            try:
+                expired = self.expire()
+                if expired:
+                    logger.info(f"Marked users as offline due to inactivity: {expired}")
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    last_flush = time.monotonic()
+                    await self.flush()
+            except Exception as e:
+                logger.error(f"Presence loop error: {e}")
+
+    async def start(self):
+        if self._task is None:
+            # Статусы, оставшиеся в БД от прошлого запуска, недействительны
+            if RESET_ON_START:
+                await UserRepository.reset_presence()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "online": len(self.online_users()),
+            "tracked": len(self._state),
+            "heap_size": len(self._heap),
+            "pending_writes": len(self._dirty),
+            "transitions": self._transitions,
+            "expired": self._expired,
+            "flushes": self._flushes,
+            "flushed_rows": self._flushed_rows,
+            "timeout_seconds": self.timeout,
+        }
+
+
+presence = PresenceService()
@@ -0,0 +1,133 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import HTTPException, Request
+
+from metrics import registry
+
+# Ограничение частоты запросов корзинами токенов: ёмкость burst, пополнение burst/period в секунду.
+# Ключ - id пользователя (dependencies.limit_user) или IP для входа и регистрации (limit_ip).
+# Переопределение: MESSENGER_RATE_LIMITS="messages.send=30/10,auth.login=off"; "off" отключает всё.
+MAX_TRACKED_KEYS = 50_000
+
+
+class RateLimit(NamedTuple):
+    burst: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.burst / self.period
+
+
+DEFAULT_LIMITS: Dict[str, RateLimit] = {
+    # Любой запрос с токеном
+    "user": RateLimit(300, 60),
+    "messages.send": RateLimit(30, 10),
+    "messages.search": RateLimit(30, 60),
+    "attachments.upload": RateLimit(30, 60),
+    "admin.export": RateLimit(5, 60),
+    "auth.status": RateLimit(10, 60),
+    # По IP
+    "auth.login": RateLimit(10, 60),
+    "auth.register": RateLimit(20, 3600),
+    # WebSocket: подключения и входящие кадры на пользователя
+    "ws.connect": RateLimit(20, 60),
+    "ws.frame": RateLimit(60, 10),
+}
+
+
+def parse_limits(spec: Optional[str], defaults: Dict[str, RateLimit] = DEFAULT_LIMITS) -> Dict[str, Optional[RateLimit]]:
+    """Правила по умолчанию с переопределениями из строки "имя=burst/period,имя=off" """
+    limits: Dict[str, Optional[RateLimit]] = dict(defaults)
+    if not spec:
+        return limits
+    if spec.strip() == "off":
+        return {name: None for name in limits}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        name, value = name.strip(), value.strip()
+        if not name:
+            continue
+        if value == "off":
+            limits[name] = None
+            continue
+        burst, _, period = value.partition("/")
+        limits[name] = RateLimit(int(burst), float(period or 1))
+    return limits
+
+
+rate_limited_total = registry.counter(
+    "messenger_rate_limited_total", "Requests and WebSocket frames rejected by rate limits", ("rule",)
+)
+
+
+class RateLimiter:
+    """Корзины токенов в памяти процесса; давно не использованные ключи вытесняются (LRU)"""
+
+    def __init__(self, limits: Dict[str, Optional[RateLimit]], max_keys: int = MAX_TRACKED_KEYS):
+        self.limits = limits
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # (правило, ключ) -> [токены, время обновления]
+        self._lock = threading.Lock()
+        self._allowed: Dict[str, int] = {}
+        self._limited: Dict[str, int] = {}
+
+    def acquire(self, rule: str, key, cost: float = 1.0) -> float:
+        """Списать токен; 0 - разрешено, иначе через сколько секунд повторить"""
+        limit = self.limits.get(rule)
+        if limit is None:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((rule, key))
+            if bucket is None:
+                bucket = self._buckets[(rule, key)] = [float(limit.burst), now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end((rule, key))
+                bucket[0] = min(float(limit.burst), bucket[0] + (now - bucket[1]) * limit.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self._allowed[rule] = self._allowed.get(rule, 0) + 1
+                return 0.0
+            self._limited[rule] = self._limited.get(rule, 0) + 1
+            retry_after = (cost - bucket[0]) / limit.rate
+        rate_limited_total.inc(rule)
+        return retry_after
+
+    def check(self, rule: str, key):
+        """Как acquire, но при превышении - HTTP 429 с заголовком Retry-After"""
+        retry_after = self.acquire(rule, key)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tracked_keys": len(self._buckets),
+                "limits": {name: (f"{limit.burst}/{limit.period:g}s" if limit else "off")
+                           for name, limit in self.limits.items()},
+                "allowed": dict(self._allowed),
+                "limited": dict(self._limited),
+            }
+
+
+rate_limiter = RateLimiter(parse_limits(os.environ.get("MESSENGER_RATE_LIMITS")))
+
+
+def limit_ip(rule: str):
+    """Зависимость маршрута без авторизации: корзина на IP клиента"""
+    async def dependency(request: Request):
+        rate_limiter.check(rule, request.client.host if request.client else None)
+    return dependency
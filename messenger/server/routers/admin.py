@@ -1,28 +1,128 @@
-from fastapi import APIRouter, HTTPException, Depends
-from database.user_model import UserModel  # Измененный импорт
-from database.message_model import MessageModel  # Измененный импорт
-from dependencies import get_current_user
-from database.db import get_db_connection, init_db
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from database.repositories import MessageRepository, UserRepository
+from dependencies import get_current_user, limit_user
+from database.db import pool
+from database.executor import db_executor
+from database.write_pipeline import message_pipeline
+from thumbnails import thumbnail_service
+from activity import activity_tracker
+from cache import token_cache, user_cache
+from passwords import password_hasher
+from presence import presence
+from websocket_manager import manager
+from fanout import fanout
+from maintenance import maintenance_service
+from ratelimit import rate_limiter
+from database.message_model import MessageModel, EXPORT_COLUMNS
+from schemas.message import MessageType
+from serialization import FastJSONResponse, message_rows, user_rows, iso_datetime, dumps
+from datetime import datetime
+from typing import Literal, Optional
+import csv
+import io
 
 router = APIRouter()
 
 @router.get("/all-messages")
 async def get_all_messages(current_user: dict = Depends(get_current_user)):
-    if not UserModel.is_admin(current_user["id"]):
+    if not await UserRepository.is_admin(current_user["id"]):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM messages ORDER BY timestamp DESC")
-    messages = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    messages = await MessageRepository.get_all_messages()
     
-    return {"messages": messages}
+    return FastJSONResponse({"messages": message_rows(messages)})
+
+def _export_ndjson(batches):
+    for rows in batches:
+        lines = []
+        for row in rows:
+            row["timestamp"] = iso_datetime(row["timestamp"])
+            row["is_read"] = bool(row["is_read"])
+            lines.append(dumps(row))
+        yield b"\n".join(lines) + b"\n"
+
+def _export_csv(batches, include_file_data: bool):
+    columns = EXPORT_COLUMNS + (("file_data",) if include_file_data else ())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows([row[column] for column in columns] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+@router.get("/export/messages", dependencies=[Depends(limit_user("admin.export"))])
+async def export_messages(
+    current_user: dict = Depends(get_current_user),
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    user_id: Optional[int] = Query(None),
+    message_type: Optional[MessageType] = Query(None),
+    include_file_data: bool = Query(False)
+):
+    """
+    Потоковая выгрузка сообщений в NDJSON или CSV.
+    Строки читаются пачками через fetchmany, поэтому память не растёт с размером таблицы.
+    """
+    if not await UserRepository.is_admin(current_user["id"]):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    batches = MessageModel.export_messages(
+        since, until, user_id, message_type.value if message_type else None, include_file_data
+    )
+    # Синхронный генератор Starlette выполняет в пуле потоков, event loop не блокируется
+    if format == "csv":
+        body, media_type = _export_csv(batches, include_file_data), "text/csv; charset=utf-8"
+    else:
+        body, media_type = _export_ndjson(batches), "application/x-ndjson"
+    filename = f"messages-{datetime.now():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @router.get("/all-users")
 async def get_all_users_info(current_user: dict = Depends(get_current_user)):
-    if not UserModel.is_admin(current_user["id"]):
+    if not await UserRepository.is_admin(current_user["id"]):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    users = await UserRepository.get_all_users()
+    return FastJSONResponse({"users": user_rows(presence.apply(user) for user in users)})
+
+@router.get("/stats")
+async def get_server_stats(current_user: dict = Depends(get_current_user)):
+    """Внутренние счётчики сервера (пул соединений БД, очереди запросов, миниатюры, кэши)"""
+    if not await UserRepository.is_admin(current_user["id"]):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        "db_pool": pool.stats(),
+        "db_executor": db_executor.stats(),
+        "message_pipeline": message_pipeline.stats(),
+        "thumbnails": thumbnail_service.stats(),
+        "token_cache": token_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "activity": activity_tracker.stats(),
+        "password_hasher": password_hasher.stats(),
+        "presence": presence.stats(),
+        "websocket": manager.stats(),
+        "websocket_connections": manager.connection_stats(),
+        "fanout": fanout.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "maintenance": maintenance_service.stats()
+    }
+
+@router.post("/maintenance")
+async def run_maintenance(current_user: dict = Depends(get_current_user)):
+    """Внеочередной проход обслуживания базы; возвращает отчёт об освобождённом месте"""
+    if not await UserRepository.is_admin(current_user["id"]):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    users = UserModel.get_all_users()
-    return {"users": users}
\ No newline at end of file
+    report = await maintenance_service.run_once()
+    if report is None:
+        raise HTTPException(status_code=409, detail="Maintenance is already running in another worker")
+    return report
@@ -0,0 +1,193 @@
+from fastapi import APIRouter, HTTPException, Depends, File, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from database.repositories import AttachmentRepository
+from schemas.attachment import AttachmentResponse
+from dependencies import get_current_user, limit_user
+from attachment_store import attachment_store, AttachmentTooLarge, MAX_ATTACHMENT_SIZE
+from thumbnails import thumbnail_service
+import re
+
+router = APIRouter()
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Части тела копятся до этого размера и пишутся на диск в потоке, а не в event loop
+WRITE_BUFFER_SIZE = 256 * 1024
+
+
+def too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Attachment exceeds {MAX_ATTACHMENT_SIZE} bytes")
+
+
+def check_content_length(request: Request):
+    """Отказ до чтения тела, если клиент заранее сообщил слишком большой размер"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_ATTACHMENT_SIZE:
+        raise too_large()
+
+
+async def get_accessible_attachment(attachment_id: str, user_id: int) -> dict:
+    """Вложение, доступное пользователю; чужие вложения неотличимы от несуществующих"""
+    if not attachment_store.is_valid_id(attachment_id):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    attachment = await AttachmentRepository.get_attachment(attachment_id)
+    if (not attachment or not attachment_store.exists(attachment_id)
+            or not await AttachmentRepository.can_access(attachment_id, user_id)):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return attachment
+
+
+def parse_range(header: str, size: int):
+    """
+    Разбор заголовка Range (поддерживается один диапазон).
+    Возвращает (start, end) включительно или None, если заголовок не понят.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-N - последние N байт
+        length = int(end)
+        if length == 0:
+            raise HTTPException(
+                status_code=416,
+                detail="Range not satisfiable",
+                headers={"Content-Range": f"bytes */{size}"}
+            )
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+@router.post("/", response_model=AttachmentResponse, dependencies=[Depends(limit_user("attachments.upload"))])
+async def upload_attachment(
+    file: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """Загрузка вложения (multipart/form-data); одинаковые файлы хранятся один раз"""
+    if file.size is not None and file.size > MAX_ATTACHMENT_SIZE:
+        raise too_large()
+    try:
+        attachment = await run_in_threadpool(attachment_store.save_stream, file.file, MAX_ATTACHMENT_SIZE)
+    except AttachmentTooLarge:
+        raise too_large()
+    record = await AttachmentRepository.register(
+        attachment["id"], attachment["size"], attachment["mime_type"], current_user["id"]
+    )
+    thumbnail_service.schedule(record["id"], record["mime_type"])
+    return AttachmentResponse(**record)
+
+
+@router.post("/stream", response_model=AttachmentResponse, dependencies=[
+    Depends(limit_user("attachments.upload")), Depends(check_content_length)
+])
+async def upload_attachment_stream(
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Загрузка вложения телом запроса как есть (без multipart и base64).
+    Тело читается частями: хэш и запись на диск идут по мере поступления,
+    поэтому память не зависит от размера файла. Тип определяется по содержимому.
+    """
+    writer = await run_in_threadpool(attachment_store.writer, MAX_ATTACHMENT_SIZE)
+    committed = False
+    try:
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                await run_in_threadpool(writer.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(writer.write, bytes(buffer))
+        if writer.size == 0:
+            raise HTTPException(status_code=400, detail="Empty attachment")
+        attachment = await run_in_threadpool(writer.commit)
+        committed = True
+    except AttachmentTooLarge:
+        raise too_large()
+    finally:
+        if not committed:
+            writer.abort()
+
+    record = await AttachmentRepository.register(
+        attachment["id"], attachment["size"], attachment["mime_type"], current_user["id"]
+    )
+    thumbnail_service.schedule(record["id"], record["mime_type"])
+    return AttachmentResponse(**record)
+
+
+@router.get("/{attachment_id}/thumbnail")
+async def download_thumbnail(
+    attachment_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Миниатюра изображения (JPEG в пределах 200x200).
+    Если миниатюру создать нельзя, отдаётся оригинал.
+    """
+    attachment = await get_accessible_attachment(attachment_id, current_user["id"])
+
+    path = await thumbnail_service.get(attachment_id, attachment["mime_type"])
+    if path is None:
+        return FileResponse(attachment_store.path_for(attachment_id), media_type=attachment["mime_type"])
+    return FileResponse(
+        path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "private, max-age=86400"}
+    )
+
+
+@router.get("/{attachment_id}")
+async def download_attachment(
+    attachment_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """Потоковая выдача вложения с поддержкой заголовка Range"""
+    attachment = await get_accessible_attachment(attachment_id, current_user["id"])
+
+    size = attachment["size"]
+    headers = {
+        "Accept-Ranges": "bytes",
+        # Содержимое адресуется хэшем и никогда не меняется
+        "ETag": f'"{attachment_id}"',
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and size > 0:
+        byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            attachment_store.iter_range(attachment_id),
+            media_type=attachment["mime_type"],
+            headers=headers
+        )
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        attachment_store.iter_range(attachment_id, start, end),
+        status_code=206,
+        media_type=attachment["mime_type"],
+        headers=headers
+    )
@@ -1,20 +1,28 @@
 from fastapi import APIRouter, HTTPException, Depends
+from database.repositories import UserRepository
 from datetime import datetime, timedelta
-from database.user_model import UserModel
 from schemas.user import UserCreate, UserLogin, UserResponse
-from passlib.context import CryptContext
 import jwt
-from dependencies import get_current_user
+from dependencies import get_current_user, limit_user
+from ratelimit import limit_ip
+from passwords import password_hasher, PasswordHasherBusy
+from presence import presence
+from fanout import fanout
 
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = "your-secret-key-here"
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "1"})
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "1"})
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -22,7 +30,7 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
 
-@router.post("/status")
+@router.post("/status", dependencies=[Depends(limit_user("auth.status"))])
 async def update_user_status(
     status_data: dict,
     current_user: dict = Depends(get_current_user)
@@ -39,7 +47,7 @@ async def update_user_status(
             raise HTTPException(status_code=403, detail="Cannot update other user status")
         
         status_text = "online" if is_online else "offline"
-        UserModel.update_user_status(user_id, is_online, status_text)
+        presence.set_status(user_id, is_online, status_text)
         
         return {
             "status": "success",
@@ -51,37 +59,34 @@ async def update_user_status(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Status update error: {str(e)}")
 
-@router.post("/register", response_model=UserResponse)
+@router.post("/register", response_model=UserResponse, dependencies=[Depends(limit_ip("auth.register"))])
 async def register(user: UserCreate):
-    existing_user = UserModel.get_user_by_username(user.username)
+    existing_user = await UserRepository.get_user_by_username(user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     
     # Автоматически делаем первого пользователя админом
     is_admin = False
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) as count FROM users")
-    user_count = cursor.fetchone()["count"]
-    conn.close()
+    user_count = await UserRepository.count_users()
     
     if user_count == 0:  # Первый пользователь становится админом
         is_admin = True
     
-    user_id = UserModel.create_user(user.username, hashed_password, is_admin)
+    user_id = await UserRepository.create_user(user.username, hashed_password, is_admin)
+    fanout.publish_invalidation("directory")  # Список пользователей в других процессах
     
-    user_data = UserModel.get_user_by_id(user_id)
+    user_data = await UserRepository.get_user_by_id(user_id)
     return UserResponse(**user_data)
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(limit_ip("auth.login"))])
 async def login(user: UserLogin):
-    user_data = UserModel.get_user_by_username(user.username)
-    if not user_data or not verify_password(user.password, user_data["password_hash"]):
+    user_data = await UserRepository.get_user_by_username(user.username)
+    if not user_data or not await verify_password(user.password, user_data["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    UserModel.update_user_status(user_data["id"], True, "online")
+    presence.set_status(user_data["id"], True)
     
     access_token = create_access_token({"sub": user_data["username"]})
     return {"access_token": access_token, "token_type": "bearer"}
@@ -94,7 +99,7 @@ async def logout(current_user: dict = Depends(get_current_user)):
     """
     try:
         # Обновляем статус пользователя на оффлайн
-        UserModel.update_user_status(current_user["id"], False, "offline")
+        presence.set_status(current_user["id"], False)
         
         return {
             "status": "success", 
@@ -103,12 +108,3 @@ async def logout(current_user: dict = Depends(get_current_user)):
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Logout error: {str(e)}")
-
-# Добавим функцию для получения соединения с БД
-def get_db_connection():
-    import sqlite3
-    from pathlib import Path
-    DB_PATH = Path("messenger.db")
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
\ No newline at end of file
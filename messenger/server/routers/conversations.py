@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends
+from database.repositories import ConversationRepository
+from schemas.conversation import ConversationResponse
+from dependencies import get_current_user
+from presence import presence
+
+router = APIRouter()
+
+@router.get("/", response_model=list[ConversationResponse])
+async def get_conversations(current_user: dict = Depends(get_current_user)):
+    """Список контактов со счётчиками непрочитанных и последним сообщением (один запрос)"""
+    conversations = await ConversationRepository.get_conversations(current_user["id"])
+    return [ConversationResponse(**presence.apply(conversation)) for conversation in conversations]
@@ -1,12 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from database.message_model import MessageModel  # Измененный импорт
-from database.user_model import UserModel  # Измененный импорт
-from database.db import get_db_connection
-from schemas.message import MessageCreate, MessageResponse, MessagesList
-from dependencies import get_current_user
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from database.repositories import AttachmentRepository, MessageRepository, UserRepository
+from attachment_store import attachment_store, MAX_ATTACHMENT_SIZE
+from thumbnails import thumbnail_service
+from schemas.message import MessageCreate, MessageResponse, MessagesList, MessageSearchResults, ReadReceipt
+from dependencies import get_current_user, limit_user
 from websocket_manager import manager
+from serialization import FastJSONResponse, message_rows, search_row
+from typing import Optional
 import logging
-import base64
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -15,89 +17,167 @@ logger = logging.getLogger(__name__)
 async def get_messages(
     current_user: dict = Depends(get_current_user),
     contact_id: int = Query(...),
-    limit: int = Query(100, ge=1, le=1000)
+    limit: int = Query(100, ge=1, le=200),
+    before_id: Optional[int] = Query(None, ge=1),
+    after_id: Optional[int] = Query(None, ge=0)
 ):
-    messages = MessageModel.get_messages_between_users(current_user["id"], contact_id, limit)
-    return MessagesList(
-        messages=[MessageResponse(**msg) for msg in messages],
-        total_count=len(messages)
+    """
+    История переписки, новые сообщения первыми.
+    Следующая (более старая) страница запрашивается с before_id=next_before_id,
+    новые сообщения после известного - с after_id.
+    """
+    # Запрашиваем на одно сообщение больше, чтобы понять, есть ли следующая страница
+    messages = await MessageRepository.get_messages_between_users(
+        current_user["id"], contact_id, limit + 1, before_id, after_id
     )
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[1:] if after_id is not None and before_id is None else messages[:limit]
+    return FastJSONResponse({
+        "messages": message_rows(messages),
+        "total_count": len(messages),
+        "has_more": has_more,
+        "next_before_id": messages[-1]["id"] if messages else None
+    })
 
-@router.post("/", response_model=MessageResponse)
+@router.post("/", response_model=MessageResponse, dependencies=[Depends(limit_user("messages.send"))])
 async def send_message(
     message: MessageCreate,
-    current_user: dict = Depends(get_current_user)
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=64)
 ):
-    # Для изображений сохраняем file_data в базе
+    """
+    Отправка сообщения. С client_msg_id (или заголовком Idempotency-Key) запрос можно
+    безопасно повторять: повтор возвращает исходное сообщение без повторной доставки.
+    """
     message_type = message.message_type.value
     content = message.content
+    attachment_id = message.attachment_id
+    if idempotency_key and message.client_msg_id and idempotency_key != message.client_msg_id:
+        raise HTTPException(status_code=400, detail="Idempotency-Key does not match client_msg_id")
+    client_msg_id = idempotency_key or message.client_msg_id
     
-    # Если это изображение и есть file_data, сохраняем его
-    file_data = None
-    if hasattr(message, 'file_data') and message.file_data:
-        file_data = message.file_data
+    if attachment_id:
+        # Отправить можно своё вложение или полученное в одной из своих переписок
+        if (not await AttachmentRepository.get_attachment(attachment_id)
+                or not await AttachmentRepository.can_access(attachment_id, current_user["id"])):
+            raise HTTPException(status_code=400, detail="Unknown attachment")
+    elif message.file_data:
+        # Совместимость со старыми клиентами: base64 переносим в хранилище вложений.
+        # Новые клиенты загружают файл через POST /attachments/stream и передают attachment_id
+        if len(message.file_data) * 3 // 4 > MAX_ATTACHMENT_SIZE:
+            raise HTTPException(status_code=413, detail=f"Attachment exceeds {MAX_ATTACHMENT_SIZE} bytes")
+        attachment = await run_in_threadpool(attachment_store.save_base64, message.file_data)
+        if attachment is None:
+            raise HTTPException(status_code=400, detail="Invalid file_data encoding")
+        await AttachmentRepository.register(
+            attachment["id"], attachment["size"], attachment["mime_type"], current_user["id"]
+        )
+        thumbnail_service.schedule(attachment["id"], attachment["mime_type"])
+        attachment_id = attachment["id"]
     
-    message_id = MessageModel.create_message(
+    message_data = await MessageRepository.create_message(
         current_user["id"],
         message.receiver_id,
         content,
         message_type,
-        file_data
+        attachment_id,
+        client_msg_id
     )
+    if message_data["replayed"]:
+        if message_data["receiver_id"] != message.receiver_id or message_data["content"] != content:
+            raise HTTPException(status_code=409, detail="client_msg_id was already used for a different message")
+        # Сообщение уже сохранено и доставлено при первой попытке
+        response.headers["Idempotent-Replayed"] = "true"
+        return MessageResponse(**message_data)
     
-    # Get the created message with file_data
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM messages WHERE id = ?", (message_id,))
-    message_data = dict(cursor.fetchone())
-    conn.close()
+    message_response = MessageResponse(**message_data)
     
-    # Явно добавляем file_data в ответ, если он есть
-    response_data = dict(message_data)
-    if file_data:
-        response_data["file_data"] = file_data
+    # Доставляем сообщение получателю и другим устройствам отправителя
+    event = {"type": "new_message", "message": message_response.model_dump(mode="json")}
+    await manager.broadcast_to_users(event, list({message.receiver_id, current_user["id"]}))
     
-    return MessageResponse(**response_data)
+    return message_response
+
+async def apply_read_receipt(reader_id: int, contact_id: int, up_to_id: int) -> int:
+    """
+    Отметка переписки прочитанной до up_to_id и одно событие messages_read
+    отправителю (и другим устройствам читателя) вместо события на каждое сообщение.
+    """
+    updated = await MessageRepository.mark_conversation_read(reader_id, contact_id, up_to_id)
+    if updated:
+        event = {
+            "type": "messages_read",
+            "reader_id": reader_id,
+            "contact_id": contact_id,
+            "up_to_id": up_to_id,
+            "count": updated
+        }
+        await manager.broadcast_to_users(event, list({contact_id, reader_id}))
+    return updated
+
+@router.post("/read")
+async def mark_conversation_as_read(
+    receipt: ReadReceipt,
+    current_user: dict = Depends(get_current_user)
+):
+    updated = await apply_read_receipt(current_user["id"], receipt.contact_id, receipt.up_to_id)
+    return {"status": "success", "updated": updated}
 
 @router.put("/{message_id}/read")
 async def mark_message_as_read(
     message_id: int,
     current_user: dict = Depends(get_current_user)
 ):
-    MessageModel.mark_as_read(message_id)
+    # Прочитанным отмечает только получатель, как и в POST /read
+    if not await MessageRepository.mark_as_read(message_id, current_user["id"]):
+        raise HTTPException(status_code=404, detail="Message not found")
     return {"status": "success", "message": "Message marked as read"}
 
 @router.get("/unread", response_model=MessagesList)
 async def get_unread_messages(current_user: dict = Depends(get_current_user)):
-    messages = MessageModel.get_unread_messages(current_user["id"])
-    return MessagesList(
-        messages=[MessageResponse(**msg) for msg in messages],
-        total_count=len(messages)
-    )
+    messages = await MessageRepository.get_unread_messages(current_user["id"])
+    return FastJSONResponse({
+        "messages": message_rows(messages),
+        "total_count": len(messages),
+        "has_more": False,
+        "next_before_id": None
+    })
+
+@router.get("/search", response_model=MessageSearchResults, dependencies=[Depends(limit_user("messages.search"))])
+async def search_messages(
+    current_user: dict = Depends(get_current_user),
+    q: str = Query(..., min_length=1, max_length=200),
+    contact_id: Optional[int] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000)
+):
+    """Поиск по сообщениям в переписках текущего пользователя"""
+    results = await MessageRepository.search_messages(current_user["id"], q, contact_id, limit + 1, offset)
+    return FastJSONResponse({
+        "results": [search_row(row) for row in results[:limit]],
+        "has_more": len(results) > limit
+    })
 
 @router.delete("/{message_id}")
 async def delete_message(
     message_id: int,
     current_user: dict = Depends(get_current_user)
 ):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
         # Получаем полную информацию о сообщении
-        cursor.execute("SELECT id, sender_id, receiver_id, content, timestamp FROM messages WHERE id = ?", (message_id,))
-        message = cursor.fetchone()
+        message = await MessageRepository.get_message(message_id)
         
         if not message:
             raise HTTPException(status_code=404, detail="Message not found")
         
         # Проверяем права на удаление
-        if message["sender_id"] != current_user["id"] and not UserModel.is_admin(current_user["id"]):
+        if message["sender_id"] != current_user["id"] and not await UserRepository.is_admin(current_user["id"]):
             raise HTTPException(status_code=403, detail="Cannot delete other users messages")
         
         # Удаляем сообщение
-        cursor.execute("DELETE FROM messages WHERE id = ?", (message_id,))
-        conn.commit()
+        await MessageRepository.delete_message(message_id)
         
         # Получаем ID участников переписки
         participant_ids = [message["sender_id"], message["receiver_id"]]
@@ -124,6 +204,4 @@ async def delete_message(
         raise
     except Exception as e:
         logger.error(f"Error deleting message {message_id}: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
-    finally:
-        conn.close()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
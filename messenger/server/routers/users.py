@@ -1,28 +1,30 @@
 from fastapi import APIRouter, HTTPException, Depends
-from database.user_model import UserModel  # Измененный импорт
+from database.repositories import UserRepository
 from schemas.user import UserResponse, UserUpdate
 from dependencies import get_current_user
+from presence import presence
+from serialization import FastJSONResponse, user_row, user_rows
 
 router = APIRouter()
 
 @router.get("/", response_model=list[UserResponse])
 async def get_all_users(current_user: dict = Depends(get_current_user)):
-    users = UserModel.get_all_users()
-    return [UserResponse(**user) for user in users]
+    users = await UserRepository.get_all_users()
+    return FastJSONResponse(user_rows(presence.apply(user) for user in users))
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
-    user = UserModel.get_user_by_id(current_user["id"])
+    user = await UserRepository.get_user_by_id(current_user["id"])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return UserResponse(**user)
+    return FastJSONResponse(user_row(presence.apply(user)))
 
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user(user_id: int, current_user: dict = Depends(get_current_user)):
-    user = UserModel.get_user_by_id(user_id)
+    user = await UserRepository.get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return UserResponse(**user)
+    return FastJSONResponse(user_row(presence.apply(user)))
 
 @router.put("/{user_id}", response_model=UserResponse)
 async def update_user(
@@ -33,5 +35,5 @@ async def update_user(
     if user_id != current_user["id"]:
         raise HTTPException(status_code=403, detail="Cannot update other users")
     
-    user = UserModel.get_user_by_id(user_id)
-    return UserResponse(**user)
\ No newline at end of file
+    user = await UserRepository.get_user_by_id(user_id)
+    return FastJSONResponse(user_row(presence.apply(user)))
\ No newline at end of file
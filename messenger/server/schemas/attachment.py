@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+class AttachmentResponse(BaseModel):
+    id: str
+    size: int
+    mime_type: str
+    created_at: Optional[datetime] = None
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+from schemas.user import UserStatus
+from schemas.message import MessageType
+
+class ConversationResponse(BaseModel):
+    id: int
+    username: str
+
+    is_online: bool
+    last_seen: Optional[datetime] = None
+    status: UserStatus
+
+    unread_count: int = 0
+    last_message_id: Optional[int] = None
+    last_timestamp: Optional[datetime] = None
+    last_sender_id: Optional[int] = None
+    last_message_type: Optional[MessageType] = None
+    last_message_preview: Optional[str] = None
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
 from enum import Enum
 from typing import Optional
@@ -12,10 +12,16 @@ class MessageBase(BaseModel):
     content: str
     receiver_id: int
     message_type: MessageType = MessageType.TEXT
-    file_data: Optional[str] = None  # Добавляем поле для данных файла
+    file_data: Optional[str] = None  # base64 файла (устаревший способ, сохраняется во вложения)
+    attachment_id: Optional[str] = None  # id вложения, загруженного через /attachments
 
 class MessageCreate(MessageBase):
-    pass
+    # Ключ идемпотентности от клиента (или заголовок Idempotency-Key): повтор не создаёт дубликат
+    client_msg_id: Optional[str] = Field(None, min_length=1, max_length=64)
+
+class ReadReceipt(BaseModel):
+    contact_id: int  # Собеседник, чьи сообщения прочитаны
+    up_to_id: int  # Прочитаны все входящие сообщения с id <= up_to_id
 
 class MessageResponse(BaseModel):
     id: int
@@ -25,11 +31,30 @@ class MessageResponse(BaseModel):
     timestamp: datetime
     is_read: bool
     message_type: str
-    file_data: Optional[str] = None  # Добавляем в ответ
+    file_data: Optional[str] = None  # Больше не заполняется: данные доступны по attachment_id
+    attachment_id: Optional[str] = None
+    thumbnail_url: Optional[str] = None  # Миниатюра для изображений, оригинал - /attachments/{id}
+    client_msg_id: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+    @model_validator(mode="after")
+    def fill_thumbnail_url(self):
+        if self.message_type == MessageType.IMAGE.value and self.attachment_id and not self.thumbnail_url:
+            self.thumbnail_url = f"/attachments/{self.attachment_id}/thumbnail"
+        return self
+
 class MessagesList(BaseModel):
     messages: list[MessageResponse]
-    total_count: int
\ No newline at end of file
+    total_count: int
+    has_more: bool = False  # Есть ли ещё сообщения за пределами страницы
+    next_before_id: Optional[int] = None  # Курсор для загрузки более старых сообщений
+
+class MessageSearchResult(MessageResponse):
+    snippet: str  # Фрагмент текста с выделенными совпадениями
+    rank: float
+
+class MessageSearchResults(BaseModel):
+    results: list[MessageSearchResult]
+    has_more: bool = False
@@ -0,0 +1,79 @@
+import json
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Без orjson - стандартный json, но без проверки моделей на каждую строку
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ через orjson (если установлен)"""
+
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+def dumps(data) -> bytes:
+    """JSON в байтах: orjson, если установлен"""
+    if orjson is None:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    return orjson.dumps(data)
+
+
+# Быстрая сериализация строк БД, которым мы доверяем: словари собираются напрямую,
+# без создания pydantic-модели на каждую строку. Формат совпадает с MessageResponse/UserResponse.
+
+MESSAGE_FIELDS = ("id", "sender_id", "receiver_id", "content", "timestamp", "is_read",
+                  "message_type", "file_data", "attachment_id", "client_msg_id")
+USER_FIELDS = ("id", "username", "is_online", "last_seen", "status")
+
+
+def iso_datetime(value) -> Optional[str]:
+    """SQLite хранит 'YYYY-MM-DD HH:MM:SS', pydantic отдаёт ISO 8601 с 'T'"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value.replace(" ", "T", 1)
+
+
+def message_row(row: dict) -> dict:
+    data = {field: row.get(field) for field in MESSAGE_FIELDS}
+    data["timestamp"] = iso_datetime(data["timestamp"])
+    data["is_read"] = bool(data["is_read"])
+    attachment_id = data["attachment_id"]
+    data["thumbnail_url"] = (
+        f"/attachments/{attachment_id}/thumbnail"
+        if attachment_id and data["message_type"] == "image" else None
+    )
+    return data
+
+
+def message_rows(rows: Iterable[dict]) -> List[dict]:
+    return [message_row(row) for row in rows]
+
+
+def search_row(row: dict) -> dict:
+    data = message_row(row)
+    data["snippet"] = row["snippet"]
+    data["rank"] = row["rank"]
+    return data
+
+
+def user_row(row: dict) -> dict:
+    return {
+        "id": row["id"],
+        "username": row["username"],
+        "is_online": bool(row["is_online"]),
+        "last_seen": iso_datetime(row.get("last_seen")),
+        "status": row["status"],
+    }
+
+
+def user_rows(rows: Iterable[dict]) -> List[dict]:
+    return [user_row(row) for row in rows]
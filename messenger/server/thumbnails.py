@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from attachment_store import attachment_store
+
+try:
+    from PIL import Image
+except ImportError:  # Без Pillow миниатюры не создаются, отдаётся оригинал
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_DIR = Path("thumbnails")
+THUMBNAIL_SIZE = (200, 200)
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ThumbnailService:
+    """Создание миниатюр изображений в пуле потоков и их кэш на диске с вытеснением"""
+
+    def __init__(self, store=attachment_store, root=None, size=THUMBNAIL_SIZE,
+                 max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES, workers: int = THUMBNAIL_WORKERS):
+        self.store = store
+        self.root = Path(root or THUMBNAILS_DIR)
+        self.size = size
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._cache_bytes = None
+        self._generated = 0
+        self._hits = 0
+        self._failures = 0
+        self._evicted = 0
+
+    @staticmethod
+    def is_supported(mime_type: Optional[str]) -> bool:
+        return Image is not None and bool(mime_type) and mime_type.startswith("image/")
+
+    def path_for(self, attachment_id: str) -> Path:
+        if not self.store.is_valid_id(attachment_id):
+            raise ValueError(f"Invalid attachment id: {attachment_id!r}")
+        return self.root / attachment_id[:2] / f"{attachment_id}.jpg"
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _generate(self, attachment_id: str) -> Optional[Path]:
+        """Создание миниатюры (выполняется в потоке пула)"""
+        path = self.path_for(attachment_id)
+        if path.exists():
+            return path
+        try:
+            with Image.open(self.store.path_for(attachment_id)) as image:
+                image.draft("RGB", self.size)  # Для JPEG декодируем сразу в уменьшенном масштабе
+                image.thumbnail(self.size)
+                if image.mode not in ("RGB", "L"):
+                    background = Image.new("RGB", image.size, (255, 255, 255))
+                    rgba = image.convert("RGBA")
+                    background.paste(rgba, mask=rgba.getchannel("A"))
+                    image = background
+                path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".part")
+                with os.fdopen(fd, "wb") as f:
+                    image.save(f, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+                os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Cannot create thumbnail for {attachment_id}: {e}")
+            with self._lock:
+                self._failures += 1
+            return None
+
+        with self._lock:
+            self._generated += 1
+        self._account(path.stat().st_size)
+        return path
+
+    def _account(self, added_bytes: int):
+        """Учёт размера кэша и вытеснение давно не использованных миниатюр"""
+        with self._lock:
+            if self._cache_bytes is None:
+                self._cache_bytes = sum(p.stat().st_size for p in self.root.glob("*/*.jpg"))
+            else:
+                self._cache_bytes += added_bytes
+            if self._cache_bytes <= self.max_bytes:
+                return
+            files = sorted(self.root.glob("*/*.jpg"), key=lambda p: p.stat().st_mtime)
+            for file in files:
+                if self._cache_bytes <= self.max_bytes * 0.9:
+                    break
+                try:
+                    size = file.stat().st_size
+                    file.unlink()
+                except FileNotFoundError:
+                    continue
+                self._cache_bytes -= size
+                self._evicted += 1
+
+    def discard(self, attachment_id: str) -> int:
+        """Удалить миниатюру (вложение удалено); возвращает число освобождённых байт"""
+        path = self.path_for(attachment_id)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        with self._lock:
+            if self._cache_bytes is not None:
+                self._cache_bytes -= size
+        return size
+
+    def schedule(self, attachment_id: str, mime_type: str):
+        """Поставить создание миниатюры в очередь (при загрузке изображения)"""
+        if not self.is_supported(mime_type):
+            return None
+        self.start()
+        with self._lock:
+            future = self._pending.get(attachment_id)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._generate, attachment_id)
+            self._pending[attachment_id] = future
+        future.add_done_callback(lambda _: self._forget(attachment_id))
+        return future
+
+    def _forget(self, attachment_id: str):
+        with self._lock:
+            self._pending.pop(attachment_id, None)
+
+    async def get(self, attachment_id: str, mime_type: str) -> Optional[Path]:
+        """Путь к миниатюре; при отсутствии в кэше она создаётся в пуле"""
+        path = self.path_for(attachment_id)
+        if path.exists():
+            with self._lock:
+                self._hits += 1
+            try:
+                os.utime(path)  # Отмечаем использование для вытеснения по давности
+            except FileNotFoundError:
+                pass
+            else:
+                return path
+        future = self.schedule(attachment_id, mime_type)
+        if future is None:
+            return None
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": Image is not None,
+                "pending": len(self._pending),
+                "generated": self._generated,
+                "cache_hits": self._hits,
+                "failures": self._failures,
+                "evicted": self._evicted,
+                "cache_bytes": self._cache_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+thumbnail_service = ThumbnailService()
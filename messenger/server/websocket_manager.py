@@ -1,26 +1,179 @@
-from typing import Dict, Set
+from collections import deque
+from typing import Dict, Iterable, Set, Union
 from fastapi import WebSocket, WebSocketDisconnect
 import asyncio
 import logging
 from datetime import datetime
 import json
+from presence import presence
+from fanout import fanout
+from ws_protocol import JsonCodec
+from database.repositories import ConversationRepository
 
 logger = logging.getLogger(__name__)
 
+# Смены статуса одного пользователя в пределах окна сводятся в одно событие
+STATUS_COALESCE_WINDOW = 0.5
+
+# Очередь отправки каждого соединения
+SEND_QUEUE_SIZE = 256
+SEND_BATCH_SIZE = 64
+# Что делать при переполнении: "drop_oldest" - выбросить старые события,
+# "disconnect" - закрыть соединение (клиент переподключится и запросит sync)
+SEND_OVERFLOW_POLICY = "disconnect"
+SLOW_CONSUMER_CLOSE_CODE = 1013  # Try Again Later
+
+
+class ConnectionWriter:
+    """
+    Отдельная задача записи для одного WebSocket.
+    Отправители только кладут события в ограниченную очередь и не ждут медленного клиента;
+    накопившиеся события уходят одним кадром {"type": "batch", "events": [...]}.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: int, on_closed, codec=None,
+                 max_queue: int = SEND_QUEUE_SIZE, policy: str = SEND_OVERFLOW_POLICY):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.codec = codec or JsonCodec(name=None)
+        self.max_queue = max_queue
+        self.policy = policy
+        self._on_closed = on_closed
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._task = None
+        self.closed = False
+        self.max_depth = 0
+        self.dropped = 0
+        self.sent_events = 0
+        self.sent_frames = 0
+        self.sent_bytes = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self.closed = True
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def enqueue(self, event: Union[dict, str]) -> bool:
+        """Поставить событие (dict) или текстовый кадр (str) в очередь; не блокирует"""
+        if self.closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "drop_oldest":
+                self._queue.popleft()
+                self.dropped += 1
+            else:
+                self.dropped += len(self._queue) + 1
+                logger.warning(f"Send queue overflow for user {self.user_id}, closing slow connection")
+                self._queue.clear()
+                asyncio.create_task(self._close(SLOW_CONSUMER_CLOSE_CODE))
+                return False
+        self._queue.append(event)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._ready.set()
+        return True
+
+    async def _send(self, events: list):
+        event = events[0] if len(events) == 1 else {"type": "batch", "events": events}
+        frame = self.codec.encode(event)
+        if self.codec.binary:
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+        self.sent_events += len(events)
+        self.sent_frames += 1
+        self.sent_bytes += len(frame) if self.codec.binary else len(frame.encode())
+
+    async def _run(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    events = []
+                    while self._queue and len(events) < SEND_BATCH_SIZE:
+                        item = self._queue.popleft()
+                        if isinstance(item, str):
+                            # Текстовые кадры (pong старых клиентов) не упаковываются в пакет
+                            if events:
+                                await self._send(events)
+                                events = []
+                            await self.websocket.send_text(item)
+                            self.sent_frames += 1
+                            continue
+                        events.append(item)
+                    if events:
+                        await self._send(events)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error sending to user {self.user_id}: {e}")
+            await self._close()
+
+    async def _close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.stop()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+        self._on_closed(self.websocket, self.user_id)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_depth,
+            "dropped": self.dropped,
+            "sent_events": self.sent_events,
+            "sent_frames": self.sent_frames,
+            "sent_bytes": self.sent_bytes,
+            "protocol": self.codec.name or "legacy-json",
+        }
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[int, Set[WebSocket]] = {}
+        self._writers: Dict[WebSocket, ConnectionWriter] = {}
+        self._dropped_closed = 0  # Выброшено соединениями, которые уже закрыты
+        # Индекс подписок: за чьим статусом следит каждый подключённый пользователь.
+        # Контакты (из conversation_state) - на пользователя, подписки клиента - на соединение.
+        self._contacts: Dict[int, Set[int]] = {}
+        self._contact_watchers: Dict[int, Set[int]] = {}
+        self._subscriptions: Dict[WebSocket, Set[int]] = {}
+        self._subscription_watchers: Dict[int, Dict[int, int]] = {}
+        # Отложенные события статуса: user_id -> (is_online, timestamp)
+        self._pending_status: Dict[int, tuple] = {}
+        self._announced_status: Dict[int, bool] = {}
+        self._status_flush = None
+        self._status_events = 0
+        self._status_coalesced = 0
+        self._status_sends = 0
+        self._status_max_fanout = 0
     
-    async def connect(self, websocket: WebSocket, user_id: int):
+    async def connect(self, websocket: WebSocket, user_id: int, codec=None):
         try:
-            await websocket.accept()
+            await websocket.accept(subprotocol=codec.name if codec else None)
             if user_id not in self.active_connections:
                 self.active_connections[user_id] = set()
+                fanout.attach(user_id)
+                await self._load_contacts(user_id)
             self.active_connections[user_id].add(websocket)
+            writer = ConnectionWriter(websocket, user_id, self.disconnect, codec)
+            self._writers[websocket] = writer
+            writer.start()
             logger.info(f"User {user_id} connected. Total connections: {len(self.active_connections.get(user_id, set()))}")
 
-            # Отправляем уведомление о новом онлайн статусе
-            await self.broadcast_status_update(user_id, True)
+            # Уведомление об онлайн-статусе рассылает presence при смене состояния
+            presence.heartbeat(user_id)
         except Exception as e:
             logger.error(f"Error connecting user {user_id}: {e}")
             raise
@@ -29,52 +182,165 @@ class ConnectionManager:
         try:
             if user_id in self.active_connections and websocket in self.active_connections[user_id]:
                 self.active_connections[user_id].discard(websocket)
+                writer = self._writers.pop(websocket, None)
+                if writer is not None:
+                    writer.stop()
+                    self._dropped_closed += writer.dropped
+                self.unsubscribe(websocket, user_id)
                 if not self.active_connections[user_id]:
                     del self.active_connections[user_id]
-                    # Отправляем уведомление об оффлайн статусе
-                    asyncio.create_task(self.broadcast_status_update(user_id, False))
+                    fanout.detach(user_id)
+                    self._drop_contacts(user_id)
+                    # Последнее соединение закрыто - пользователь оффлайн
+                    presence.disconnect(user_id)
                 logger.info(f"User {user_id} disconnected. Remaining connections: {len(self.active_connections.get(user_id, set()))}")
         except Exception as e:
             logger.error(f"Error disconnecting user {user_id}: {e}")
     
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections and self.active_connections[user_id]:
-            dead_connections = []
-            for connection in list(self.active_connections[user_id]):
-                try:
-                    await connection.send_json(message)
-                    logger.debug(f"Message sent to user {user_id}: {message}")
-                except Exception as e:
-                    logger.error(f"Error sending message to user {user_id}: {e}")
-                    dead_connections.append(connection)
-            
-            # Удаляем мертвые соединения
-            for connection in dead_connections:
-                self.disconnect(connection, user_id)
-        else:
-            logger.debug(f"No active connections for user {user_id}")
+    def send_to_connection(self, websocket: WebSocket, message: Union[dict, str]) -> bool:
+        """Поставить событие в очередь отправки конкретного соединения"""
+        writer = self._writers.get(websocket)
+        return writer.enqueue(message) if writer is not None else False
     
-    async def broadcast_to_users(self, message: dict, user_ids: list[int]):
+    def deliver_local(self, message: dict, user_ids: Iterable[int]):
+        """Поставить событие в очереди соединений получателей в этом процессе (не ждёт отправки)"""
+        if message.get("type") == "new_message":
+            # Участники новой переписки начинают получать статусы друг друга
+            self.add_contact(message["message"]["sender_id"], message["message"]["receiver_id"])
         for user_id in user_ids:
-            await self.send_personal_message(message, user_id)
+            connections = self.active_connections.get(user_id)
+            if not connections:
+                logger.debug(f"No active connections for user {user_id}")
+                continue
+            for connection in list(connections):
+                self.send_to_connection(connection, message)
     
-    async def broadcast_status_update(self, user_id: int, is_online: bool):
-        """Рассылка уведомления об изменении статуса пользователя"""
+    async def send_personal_message(self, message: dict, user_id: int):
+        await fanout.publish(message, [user_id])
+    
+    async def broadcast_to_users(self, message: dict, user_ids: Iterable[int]):
+        """Доставка получателям в любом процессе; медленные клиенты не задерживают отправителя"""
+        await fanout.publish(message, user_ids)
+    
+    async def _load_contacts(self, user_id: int):
         try:
+            contacts = set(await ConversationRepository.get_peer_ids(user_id))
+        except Exception as e:
+            logger.error(f"Error loading contacts for user {user_id}: {e}")
+            contacts = set()
+        contacts.discard(user_id)
+        self._contacts[user_id] = contacts
+        for contact_id in contacts:
+            self._contact_watchers.setdefault(contact_id, set()).add(user_id)
+    
+    def _drop_contacts(self, user_id: int):
+        for contact_id in self._contacts.pop(user_id, set()):
+            watchers = self._contact_watchers.get(contact_id)
+            if watchers is not None:
+                watchers.discard(user_id)
+                if not watchers:
+                    del self._contact_watchers[contact_id]
+    
+    def add_contact(self, user_id: int, contact_id: int):
+        """Новая переписка: пользователи начинают получать статусы друг друга"""
+        for watcher, subject in ((user_id, contact_id), (contact_id, user_id)):
+            if watcher != subject and watcher in self._contacts:
+                self._contacts[watcher].add(subject)
+                self._contact_watchers.setdefault(subject, set()).add(watcher)
+    
+    def subscribe(self, websocket: WebSocket, user_id: int, subject_ids: Iterable[int]):
+        """Подписка соединения на статусы пользователей (открытые чаты)"""
+        subscriptions = self._subscriptions.setdefault(websocket, set())
+        for subject_id in subject_ids:
+            if subject_id == user_id or subject_id in subscriptions:
+                continue
+            subscriptions.add(subject_id)
+            watchers = self._subscription_watchers.setdefault(subject_id, {})
+            watchers[user_id] = watchers.get(user_id, 0) + 1
+    
+    def unsubscribe(self, websocket: WebSocket, user_id: int, subject_ids: Iterable[int] = None):
+        subscriptions = self._subscriptions.get(websocket)
+        if not subscriptions:
+            self._subscriptions.pop(websocket, None)
+            return
+        removed = set(subject_ids) & subscriptions if subject_ids is not None else set(subscriptions)
+        subscriptions -= removed
+        if not subscriptions:
+            del self._subscriptions[websocket]
+        for subject_id in removed:
+            watchers = self._subscription_watchers.get(subject_id, {})
+            watchers[user_id] = watchers.get(user_id, 1) - 1
+            if watchers[user_id] <= 0:
+                del watchers[user_id]
+            if not watchers:
+                self._subscription_watchers.pop(subject_id, None)
+    
+    def watchers_of(self, user_id: int) -> Set[int]:
+        """Подключённые пользователи, которым интересен статус user_id"""
+        watchers = set(self._contact_watchers.get(user_id, ()))
+        watchers.update(self._subscription_watchers.get(user_id, ()))
+        watchers.discard(user_id)
+        return watchers
+    
+    async def broadcast_status_update(self, user_id: int, is_online: bool):
+        """
+        Уведомление об изменении статуса пользователя.
+        События копятся STATUS_COALESCE_WINDOW секунд: если пользователь за это время
+        вернулся в прежнее состояние (переподключение), ничего не отправляется.
+        """
+        self._status_events += 1
+        if user_id in self._pending_status:
+            self._status_coalesced += 1
+        self._pending_status[user_id] = (is_online, datetime.now().isoformat())
+        if self._status_flush is None:
+            self._status_flush = asyncio.create_task(self._flush_status_updates())
+    
+    async def _flush_status_updates(self):
+        await asyncio.sleep(STATUS_COALESCE_WINDOW)
+        pending, self._pending_status = self._pending_status, {}
+        self._status_flush = None
+        
+        for user_id, (is_online, timestamp) in pending.items():
+            if self._announced_status.get(user_id, False) == is_online:
+                self._status_coalesced += 1
+                continue
+            self._announced_status[user_id] = is_online
             status_message = {
                 "type": "user_status_update",
                 "user_id": user_id,
                 "is_online": is_online,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": timestamp
             }
-            
-            # Отправляем всем пользователям, кроме самого пользователя
-            for other_user_id in self.active_connections:
-                if other_user_id != user_id:
-                    await self.send_personal_message(status_message, other_user_id)
-            
-            logger.info(f"Broadcast status update: user {user_id} is now {'online' if is_online else 'offline'}")
-        except Exception as e:
-            logger.error(f"Error broadcasting status update for user {user_id}: {e}")
+            watchers = self.watchers_of(user_id)
+            self._status_max_fanout = max(self._status_max_fanout, len(watchers))
+            self._status_sends += len(watchers)
+            # Наблюдатели из других процессов получают событие presence от своего процесса
+            self.deliver_local(status_message, watchers)
+            logger.info(f"Status update: user {user_id} is now {'online' if is_online else 'offline'}, "
+                        f"notifying {len(watchers)} users")
+    
+    def connection_stats(self) -> list:
+        """Глубина очереди и число выброшенных событий по каждому соединению"""
+        return [writer.stats() for writer in self._writers.values()]
+    
+    def stats(self) -> dict:
+        writers = list(self._writers.values())
+        return {
+            "send_queue_size": SEND_QUEUE_SIZE,
+            "send_overflow_policy": SEND_OVERFLOW_POLICY,
+            "queued_events": sum(writer.queue_depth for writer in writers),
+            "dropped_events": self._dropped_closed + sum(writer.dropped for writer in writers),
+            "connected_users": len(self.active_connections),
+            "connections": sum(len(connections) for connections in self.active_connections.values()),
+            "contact_index_size": sum(len(watchers) for watchers in self._contact_watchers.values()),
+            "subscriptions": sum(len(subjects) for subjects in self._subscriptions.values()),
+            "status_events": self._status_events,
+            "status_coalesced": self._status_coalesced,
+            "status_sends": self._status_sends,
+            "status_max_fanout": self._status_max_fanout,
+        }
 
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
+fanout.bind(manager, presence)
+presence.add_liveness_check(lambda user_id: bool(manager.active_connections.get(user_id)))
+presence.add_listener(fanout.publish_presence)
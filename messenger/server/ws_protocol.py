@@ -0,0 +1,60 @@
+import json
+from typing import Iterable, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # Без msgpack остаётся только JSON
+    msgpack = None
+
+# Версионированные подпротоколы WebSocket в порядке предпочтения сервера.
+# Каждый кадр - типизированный конверт {"type": ..., ...}; пакет событий -
+# {"type": "batch", "events": [...]}. Сжатие больших кадров - permessage-deflate.
+PROTOCOL_MSGPACK = "messenger.v1.msgpack"
+PROTOCOL_JSON = "messenger.v1.json"
+
+
+class JsonCodec:
+    """Текстовые JSON-кадры; name=None - старые клиенты без подпротокола (с текстовым ping)"""
+    binary = False
+
+    def __init__(self, name: Optional[str] = PROTOCOL_JSON):
+        self.name = name
+
+    @property
+    def legacy(self) -> bool:
+        return self.name is None
+
+    def encode(self, event: dict) -> str:
+        return json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    """Бинарные кадры msgpack"""
+    binary = True
+    legacy = False
+    name = PROTOCOL_MSGPACK
+
+    def encode(self, event: dict) -> bytes:
+        return msgpack.packb(event, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        return msgpack.unpackb(data, raw=False)
+
+
+def supported_protocols() -> list:
+    protocols = [PROTOCOL_JSON]
+    if msgpack is not None:
+        protocols.insert(0, PROTOCOL_MSGPACK)
+    return protocols
+
+
+def negotiate(requested: Iterable[str]):
+    """Выбор кодека по заголовку Sec-WebSocket-Protocol клиента"""
+    requested = list(requested or [])
+    for protocol in supported_protocols():
+        if protocol in requested:
+            return MsgpackCodec() if protocol == PROTOCOL_MSGPACK else JsonCodec()
+    return JsonCodec(name=None)